@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""
+Fan-out benchmark for EventBroker
+
+An app with an EventBroker is served in-process with quart's test client
+and a number of websocket subscribers are connected to it. Events are put
+on the broker at a fixed rate and every subscriber records the delay
+between the put and receiving the frame.
+
+    python benchmarks/fanout.py --subscribers 10 100 1000 --namespaces 0 8 --output results.json
+
+Every combination of subscribers and namespaces is run. With namespaces
+set to 0 every subscriber listens to every event; otherwise subscribers
+and events are spread over that many namespaces.
+
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from quart import Quart
+
+from quart_events import EventBroker
+
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional
+
+    from quart.typing import TestClientProtocol
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    _index = min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))
+    return values[_index]
+
+
+async def subscriber(
+    client: TestClientProtocol,
+    path: str,
+    expected: int,
+    batch: bool,
+    connected: asyncio.Queue,
+    latencies: List[float],
+) -> int:
+    """
+    Receive frames until the expected number of events has arrived
+
+    """
+    _received = 0
+    async with client.websocket(
+        path, query_string={"batch": "1"} if batch else None
+    ) as ws:
+        await ws.receive()  # _open
+        connected.put_nowait(None)
+        while _received < expected:
+            _frame = json.loads(await ws.receive())
+            _now = time.perf_counter()
+            for _event in _frame if isinstance(_frame, list) else [_frame]:
+                if "ts" in _event:
+                    latencies.append(_now - _event["ts"])
+                    _received += 1
+    return _received
+
+
+async def run(
+    subscribers: int,
+    namespaces: int,
+    rate: float,
+    duration: float,
+    payload_size: int,
+    batch: bool,
+    drain_timeout: float,
+    shards: int = 0,
+) -> Dict[str, Any]:
+    app = Quart(__name__)
+    broker = EventBroker(app, auth=False, keepalive=3600, shards=shards)
+    client = app.test_client()
+    await app.startup()
+
+    _events = int(rate * duration)
+    _names: List[Optional[str]] = [f"ns{_i}" for _i in range(namespaces)] or [None]
+    _per_namespace = [
+        len(range(_i, _events, len(_names))) for _i in range(len(_names))
+    ]
+    _payload = "x" * payload_size
+    _latencies: List[float] = list()
+    _connected: asyncio.Queue = asyncio.Queue()
+
+    # connect the subscribers while tracing allocations
+    gc.collect()
+    tracemalloc.start()
+    _memory_start = tracemalloc.get_traced_memory()[0]
+    _tasks = list()
+    for _i in range(subscribers):
+        _namespace = _names[_i % len(_names)]
+        _tasks.append(
+            asyncio.create_task(
+                subscriber(
+                    client,
+                    # the trailing ":" keeps "ns1" from matching "ns10:bench"
+                    f"/events/ws/{_namespace}:" if _namespace else "/events/ws",
+                    _per_namespace[_i % len(_names)],
+                    batch,
+                    _connected,
+                    _latencies,
+                )
+            )
+        )
+    for _ in range(subscribers):
+        await _connected.get()
+    while len(broker.subscribers) < subscribers:
+        await asyncio.sleep(0.01)
+    gc.collect()
+    _memory = tracemalloc.get_traced_memory()[0] - _memory_start
+    tracemalloc.stop()
+
+    # publish at a fixed rate
+    _cpu_start = time.process_time()
+    _start = time.perf_counter()
+    for _i in range(_events):
+        _delay = _start + _i / rate - time.perf_counter()
+        if _delay > 0:
+            await asyncio.sleep(_delay)
+        _namespace = _names[_i % len(_names)]
+        await broker.put(
+            event=f"{_namespace}:bench" if _namespace else "bench",
+            ts=time.perf_counter(),
+            data=_payload,
+        )
+
+    _done, _pending = await asyncio.wait(_tasks, timeout=drain_timeout)
+    _elapsed = time.perf_counter() - _start
+    _cpu = time.process_time() - _cpu_start
+    for _task in _pending:
+        _task.cancel()
+    await asyncio.gather(*_pending, return_exceptions=True)
+    await app.shutdown()
+
+    _latencies.sort()
+    _deliveries = len(_latencies)
+    _expected = sum(_per_namespace[_i % len(_names)] for _i in range(subscribers))
+    return {
+        "subscribers": subscribers,
+        "namespaces": namespaces,
+        "rate": rate,
+        "duration": duration,
+        "payload_size": payload_size,
+        "batch": batch,
+        "shards": shards,
+        "events_published": _events,
+        "deliveries_expected": _expected,
+        "deliveries": _deliveries,
+        "timed_out_subscribers": len(_pending),
+        "elapsed_seconds": _elapsed,
+        "events_per_second": _events / _elapsed,
+        "deliveries_per_second": _deliveries / _elapsed,
+        "latency_ms": {
+            _name: None if _value is None else _value * 1000
+            for _name, _value in (
+                ("p50", percentile(_latencies, 0.5)),
+                ("p99", percentile(_latencies, 0.99)),
+                ("p999", percentile(_latencies, 0.999)),
+                ("max", _latencies[-1] if _latencies else None),
+            )
+        },
+        "cpu_seconds": _cpu,
+        "cpu_us_per_delivery": _cpu / _deliveries * 1e6 if _deliveries else None,
+        "memory_bytes_per_subscriber": _memory / subscribers if subscribers else 0,
+    }
+
+
+def report(result: Dict[str, Any]) -> str:
+    _latency = result["latency_ms"]
+
+    def _ms(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value:.2f}"
+
+    return (
+        f"subscribers={result['subscribers']:<6} "
+        f"namespaces={result['namespaces']:<3} "
+        f"events/s={result['events_per_second']:<9.0f} "
+        f"deliveries/s={result['deliveries_per_second']:<10.0f} "
+        f"p50={_ms(_latency['p50'])}ms "
+        f"p99={_ms(_latency['p99'])}ms "
+        f"p999={_ms(_latency['p999'])}ms "
+        f"cpu={result['cpu_seconds']:.2f}s "
+        f"mem/sub={result['memory_bytes_per_subscriber'] / 1024:.1f}KiB "
+        f"missing={result['deliveries_expected'] - result['deliveries']}"
+    )
+
+
+async def main_async(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    _results = list()
+    for _subscribers, _namespaces in itertools.product(
+        args.subscribers, args.namespaces
+    ):
+        _result = await run(
+            subscribers=_subscribers,
+            namespaces=_namespaces,
+            rate=args.rate,
+            duration=args.duration,
+            payload_size=args.payload_size,
+            batch=args.batch,
+            drain_timeout=args.drain_timeout,
+            shards=args.shards,
+        )
+        print(report(_result), flush=True)
+        _results.append(_result)
+    return _results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="quart-events fan-out benchmark")
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[10, 100])
+    parser.add_argument(
+        "--namespaces",
+        type=int,
+        nargs="+",
+        default=[0, 8],
+        help="number of namespaces to spread subscribers over; 0 disables namespaces",
+    )
+    parser.add_argument("--rate", type=float, default=500.0, help="events per second")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds to publish")
+    parser.add_argument("--payload-size", type=int, default=256)
+    parser.add_argument(
+        "--batch", action="store_true", help="subscribers connect with ?batch=1"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=0, help="EventBroker delivery shards"
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=30.0,
+        help="seconds to wait for subscribers after publishing",
+    )
+    parser.add_argument("--output", help="save the results to this json file")
+    args = parser.parse_args()
+
+    _results = asyncio.run(main_async(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "date": datetime.now(timezone.utc).isoformat(),
+                    "python": sys.version,
+                    "platform": platform.platform(),
+                    "arguments": vars(args),
+                    "results": _results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from .broker import EventBroker
 from .errors import EventBrokerError, EventBrokerAuthError
+from .subscriber import OverflowPolicy
 
 
 __version__ = "0.4.3-dev"
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import time
+from collections import Counter
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from typing import Callable, Dict, Optional
+
+
+class TokenBucket:
+    """
+    Allow rate operations per second on average with bursts of up to burst
+
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, count: int = 1) -> bool:
+        _now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (_now - self.updated) * self.rate)
+        self.updated = _now
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
+
+
+class AdmissionController:
+    """
+    Decide whether a new subscriber is accepted
+
+    Subscribers are identified by a key; EventBroker uses the session's
+    token, or the remote address when there is no token. Each check is a few
+    dict lookups so connections can be rejected before any auth callbacks
+    run.
+
+    Once closed every connection is rejected.
+
+    Parameters:
+        max_subscribers (int): maximum number of subscribers; None means unlimited
+        max_subscribers_per_key (int): maximum number of subscribers per key
+        connect_rate (float): connections per second allowed for each key;
+            None disables rate limiting
+        connect_burst (int): connections allowed for a key in a burst before
+            connect_rate applies
+
+    """
+
+    # buckets are only pruned once this many keys are tracked
+    max_tracked: int = 10000
+
+    def __init__(
+        self,
+        max_subscribers: Optional[int] = None,
+        max_subscribers_per_key: Optional[int] = None,
+        connect_rate: Optional[float] = None,
+        connect_burst: int = 10,
+    ) -> None:
+        self.max_subscribers = max_subscribers
+        self.max_subscribers_per_key = max_subscribers_per_key
+        self.connect_rate = connect_rate
+        self.connect_burst = connect_burst
+        self.active: int = 0
+        self.closed = False
+        self.rejected: Counter = Counter()
+        self._per_key: Counter = Counter()
+        self._buckets: Dict[str, TokenBucket] = dict()
+
+    def admit(self, key: str) -> Optional[str]:
+        """
+        Check the limits for a new connection
+
+        Returns:
+            None if the connection is admitted or the reason it was rejected
+
+        """
+        _reason = None
+        if self.closed:
+            _reason = "shutting down"
+        elif self.connect_rate is not None and not self._take(key):
+            _reason = "connect rate exceeded"
+        elif self.max_subscribers is not None and self.active >= self.max_subscribers:
+            _reason = "too many subscribers"
+        elif (
+            self.max_subscribers_per_key is not None
+            and self._per_key[key] >= self.max_subscribers_per_key
+        ):
+            _reason = "too many subscribers for this session"
+
+        if _reason is not None:
+            self.rejected[_reason] += 1
+        return _reason
+
+    def acquire(self, key: str) -> None:
+        self.active += 1
+        self._per_key[key] += 1
+
+    def release(self, key: str) -> None:
+        self.active -= 1
+        self._per_key[key] -= 1
+        if self._per_key[key] <= 0:
+            del self._per_key[key]
+
+    def lease(self, key: str) -> Callable[[], None]:
+        """
+        Acquire a slot for the key
+
+        Returns:
+            a function which releases the slot; only the first call has an effect
+
+        """
+        self.acquire(key)
+        _released = False
+
+        def _release() -> None:
+            nonlocal _released
+            if not _released:
+                _released = True
+                self.release(key)
+
+        return _release
+
+    def _take(self, key: str) -> bool:
+        """
+        Take a token from the key's bucket
+
+        """
+        assert self.connect_rate is not None
+        _bucket = self._buckets.get(key)
+        if _bucket is None:
+            if len(self._buckets) >= self.max_tracked:
+                self._prune()
+            _bucket = self._buckets[key] = TokenBucket(
+                self.connect_rate, self.connect_burst
+            )
+        return _bucket.take()
+
+    def _prune(self) -> None:
+        """
+        Forget the buckets which have refilled
+
+        """
+        assert self.connect_rate is not None
+        _now = time.monotonic()
+        _full = self.connect_burst / self.connect_rate
+        for _key, _bucket in list(self._buckets.items()):
+            if _now - _bucket.updated >= _full:
+                del self._buckets[_key]
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from .hub import pack_frame, read_frame
+from .message import Message
+
+
+if TYPE_CHECKING:
+    from typing import List, Optional
+
+    from .broker import EventBroker
+
+
+logger = logging.getLogger(__name__)
+
+
+class Backend:
+    """
+    Transport between EventBroker.put() and the subscriber queues
+
+    A backend receives every Message published by its broker and is
+    responsible for handing it to EventBroker.deliver() in every process
+    which holds subscribers.
+
+    Attributes:
+        local (bool): True if every subscriber lives in this process; the
+            broker then skips encoding events nobody is subscribed to
+
+    """
+
+    local: bool = True
+
+    def __init__(self) -> None:
+        self.broker: Optional[EventBroker] = None
+
+    async def start(self, broker: EventBroker) -> None:
+        self.broker = broker
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, message: Message) -> None:
+        raise NotImplementedError
+
+    async def publish_many(self, messages: List[Message]) -> None:
+        for _message in messages:
+            await self.publish(_message)
+
+
+class MemoryBackend(Backend):
+    """
+    Deliver events to the subscribers of this process only
+
+    """
+
+    async def publish(self, message: Message) -> None:
+        assert self.broker is not None
+        await self.broker.deliver(message)
+
+    async def publish_many(self, messages: List[Message]) -> None:
+        assert self.broker is not None
+        await self.broker.deliver_many(messages)
+
+
+class UnixSocketBackend(Backend):
+    """
+    Share events between worker processes through a quart_events.hub.Hub
+
+    Events are delivered to local subscribers immediately and written to the
+    hub, which forwards the encoded payload to every other worker.
+
+    Parameters:
+        path (str): path of the hub's unix domain socket
+        reconnect_delay (float): seconds to wait before reconnecting to the hub
+        connect_timeout (float): how long start() waits for the first connection
+
+    """
+
+    local = False
+
+    def __init__(
+        self, path: str, reconnect_delay: float = 1.0, connect_timeout: float = 5.0
+    ) -> None:
+        super().__init__()
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.connect_timeout = connect_timeout
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connected: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, broker: EventBroker) -> None:
+        await super().start(broker)
+        self._connected = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("hub is not available; events are delivered locally until it is")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish(self, message: Message) -> None:
+        assert self.broker is not None
+        await self.broker.deliver(message)
+        if self._writer is None:
+            logger.warning("not connected to the hub; event was only delivered locally")
+            return
+
+        self._writer.write(pack_frame(message.payload.encode(self.broker.encoding)))
+        await self._writer.drain()
+
+    async def publish_many(self, messages: List[Message]) -> None:
+        assert self.broker is not None
+        await self.broker.deliver_many(messages)
+        if self._writer is None:
+            logger.warning("not connected to the hub; events were only delivered locally")
+            return
+
+        self._writer.write(
+            b"".join(
+                pack_frame(_message.payload.encode(self.broker.encoding))
+                for _message in messages
+            )
+        )
+        await self._writer.drain()
+
+    async def _run(self) -> None:
+        assert self.broker is not None and self._connected is not None
+        while True:
+            try:
+                _reader, self._writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                logger.warning(f"could not connect to the hub at {self.path}: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            self._connected.set()
+            try:
+                while True:
+                    _payload = await read_frame(_reader)
+                    try:
+                        await self.broker.deliver(
+                            Message.decode(
+                                _payload.decode(self.broker.encoding), self.broker.codec
+                            )
+                        )
+                    except Exception as e:
+                        # a bad frame is dropped; the connection stays usable
+                        logger.exception(e)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("connection to the hub was lost")
+            finally:
+                self._connected.clear()
+                self._writer.close()
+                self._writer = None
+            await asyncio.sleep(self.reconnect_delay)
@@ -3,12 +3,31 @@ from __future__ import annotations
 import asyncio
 import logging
 import functools
-import json
+import random
+import threading
+import time
+import weakref
+from collections import Counter, deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import copy
-from dataclasses import asdict, dataclass
+from dataclasses import asdict
 from datetime import datetime, timedelta
-from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
-from uuid import UUID, uuid4
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from asyncio_multisubscriber_queue import MultisubscriberQueue
 from quart import (
@@ -19,41 +38,42 @@ from quart import (
     request,
     Response,
     session,
+    stream_with_context,
     websocket,
 )
 from werkzeug.datastructures import Headers
 
+from .admission import AdmissionController, TokenBucket
+from .backends import Backend, MemoryBackend
+from .callbacks import CallbackPipeline
+from .codecs import Codec, JsonCodec
+from .compression import Compressor
+from .eventlog import EventLog
 from .errors import EventBrokerError, EventBrokerAuthError
+from .message import Message
+from .metrics import BrokerMetrics
+from .routing import NamespaceIndex, Subscription, parse_subscription
+from .sharding import DeliveryShard
+from .subscriber import OverflowPolicy, SubscriberQueue
+from .tokens import NullToken, Token, TokenSigner, TokenStore
 
 
 logger = logging.getLogger(__name__)
 
 
 KeepAlive = object()
+Overflow = object()
+Resync = object()
+Shutdown = object()
+TokenExpired = object()
 
 
-@dataclass
-class Token:
-    value: UUID
-    date: datetime
-
-    def __str__(self):
-        return str(self.value)
-
-    @staticmethod
-    def new():
-        return Token(value=uuid4(), date=datetime.utcnow())
-
-
-class NullToken(Token):
-    def __init__(self):
-        super().__init__(value=None, date=None)
-
-    def __bool__(self) -> bool:
-        return False
+class EventBroker(MultisubscriberQueue):
+    subscribers: List[SubscriberQueue]  # type: ignore[assignment]
 
+    # events read from the event log between yields to the event loop
+    replay_chunk_size: int = 1000
 
-class EventBroker(MultisubscriberQueue):
     def __init__(
         self,
         app: Quart,
@@ -61,7 +81,36 @@ class EventBroker(MultisubscriberQueue):
         keepalive: int = 30,
         auth: bool = True,
         token_expire_seconds: int = 3600,
+        token_store_size: Optional[int] = None,
+        token_prune_interval: float = 60.0,
+        stateless_tokens: bool = False,
+        callback_executor: Optional[Union[int, Executor]] = None,
         encoding: str = "utf-8",
+        codec: Optional[Codec] = None,
+        codecs: Optional[List[Codec]] = None,
+        max_queue_size: int = 0,
+        overflow_policy: str = OverflowPolicy.DROP_OLDEST,
+        overflow_timeout: float = 1.0,
+        batch_max_size: int = 100,
+        batch_max_delay: float = 0.005,
+        backend: Optional[Backend] = None,
+        replay_size: int = 0,
+        replay_seconds: Optional[float] = None,
+        stats_route: bool = False,
+        compressor: Optional[Compressor] = None,
+        compression_threshold: int = 16384,
+        max_subscribers: Optional[int] = None,
+        max_subscribers_per_session: Optional[int] = None,
+        connect_rate: Optional[float] = None,
+        connect_burst: int = 10,
+        shutdown_timeout: float = 10.0,
+        reconnect_after: float = 1.0,
+        reconnect_jitter: float = 5.0,
+        shards: int = 0,
+        event_log: Optional[EventLog] = None,
+        client_publish: bool = False,
+        publish_rate: Optional[float] = None,
+        publish_burst: int = 100,
     ):
         """
         The constructor for EventBroker class
@@ -72,7 +121,76 @@ class EventBroker(MultisubscriberQueue):
             keepalive (int): how often to send a "keepalive" event when no new
                 events are being generated
             auth (bool): enable/disable session validation
+            token_expire_seconds (int): lifetime of an auth token
+            token_store_size (int): maximum number of live tokens kept by the
+                broker; None means unbounded
+            token_prune_interval (float): how often expired tokens are removed
+            stateless_tokens (bool): store a token signed with the SECRET_KEY in
+                the session instead of keeping issued tokens in the broker
+            callback_executor (int or concurrent.futures.Executor): run sync
+                callbacks in this executor, or in a thread pool with this many
+                workers, instead of on the event loop
             encoding (str): character encoding to use
+            codec (quart_events.codecs.Codec): text codec used for every event;
+                defaults to JsonCodec
+            codecs (list): additional codecs which clients can select with the
+                "quart-events.<name>" websocket subprotocol
+            max_queue_size (int): maximum number of events waiting for each
+                subscriber; 0 means unbounded
+            overflow_policy (str): what to do with an event when a subscriber's
+                queue is full; one of "drop_oldest", "drop_newest",
+                "disconnect" (the subscriber receives an "_overflow" event
+                and is closed) or "block" (the publisher waits up to
+                overflow_timeout seconds for room before dropping the event)
+            overflow_timeout (float): how long put() blocks under the "block" policy
+            batch_max_size (int): maximum number of events sent in one frame to
+                clients which connect with "?batch=1"
+            batch_max_delay (float): how long to wait for more events before
+                sending a batch frame
+            backend (quart_events.backends.Backend): transport used to hand
+                events to subscribers; defaults to MemoryBackend
+            replay_size (int): number of recent events kept for clients which
+                reconnect with "?since=<id>"; 0 disables replay and event ids
+            replay_seconds (float): optionally also drop events older than this
+                from the replay buffer
+            stats_route (bool): serve the broker's metrics at "<url_prefix>/stats"
+                as json, or in the prometheus text format with "?format=prometheus";
+                the route is not protected by the broker's authentication
+            compressor (quart_events.compression.Compressor): compress events
+                whose frame is at least compression_threshold long once and send
+                the compressed bytes as a binary frame to websocket clients which
+                connect with "?compress=<name>"; only applies to text codecs
+            compression_threshold (int): minimum frame length to compress
+            max_subscribers (int): reject websocket and sse connections beyond
+                this many with a "_rejected" event; None means unlimited
+            max_subscribers_per_session (int): connections allowed for one
+                session's token (or remote address when auth is disabled)
+            connect_rate (float): connections per second allowed for one
+                session; None disables rate limiting
+            connect_burst (int): connections one session can open in a burst
+                before connect_rate applies
+            shutdown_timeout (float): how long shutdown() waits for subscribers
+                to receive the events already on their queues
+            reconnect_after (float): minimum number of seconds clients are told to
+                wait before reconnecting in the "_close" event sent on shutdown
+            reconnect_jitter (float): a random number of seconds up to this is
+                added to each client's reconnect_after
+            shards (int): split subscribers into this many groups, each filled
+                by its own delivery task; put() then only hands events to the
+                shards and yields to the event loop between them; 0 delivers
+                to every subscriber inline
+            event_log (quart_events.eventlog.EventLog): durable log every event
+                is appended to; clients reconnecting with "?since=<id>" are sent
+                events from the log once they are no longer in the replay buffer
+            client_publish (bool): accept events sent by verified websocket
+                clients, as a single object or an array of up to batch_max_size
+                objects per frame; every event is checked by the publish
+                callbacks and published with put() or put_many(); a single
+                object may set "conflate_key"
+            publish_rate (float): events per second each websocket connection
+                may publish; None means unlimited
+            publish_burst (int): events one connection can publish in a burst
+                before publish_rate applies
 
         """
         if auth is True and app.config.get("SECRET_KEY") is None:
@@ -82,12 +200,76 @@ class EventBroker(MultisubscriberQueue):
 
         self.keepalive = keepalive
         self.encoding = encoding
+        self.codec: Codec = codec or JsonCodec()
+        if self.codec.binary:
+            raise ValueError("the default codec must produce text frames")
+        self._codecs: Dict[str, Codec] = {
+            _codec.subprotocol: _codec for _codec in [self.codec, *(codecs or [])]
+        }
+        self._keepalive_message = Message.new({"event": "_keepalive"}, self.codec)
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.overflow_timeout = overflow_timeout
+        self.overflow_counts: Counter = Counter()
+        self.batch_max_size = batch_max_size
+        self.batch_max_delay = batch_max_delay
+        self.backend: Backend = backend or MemoryBackend()
+        self._backend_started: Optional[asyncio.Future] = None
+        self.replay_size = replay_size
+        self.replay_seconds = replay_seconds
+        self._replay: Deque[Tuple[float, Message]] = deque(maxlen=replay_size)
+        self.event_log = event_log
+        self._last_id = 0
+        if event_log is not None and event_log.last_id is not None:
+            # ids continue from the last logged event
+            self._last_id = event_log.last_id
+        # events are stamped with ids when they are kept for replay
+        self._retain = bool(replay_size) or event_log is not None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: List[Dict[str, Any]] = list()
+        self._pending_lock = threading.Lock()
+        self._drain_scheduled = False
+        self._drain_tasks: Set[asyncio.Task] = set()
         self._auth_enabled: bool = auth
         self._token_expire_seconds = token_expire_seconds
-        self._auth_callbacks: List[Callable] = list()
-        self._verify_callbacks: List[Callable] = list()
-        self._send_callbacks: List[Callable] = list()
-        self._tokens: Dict[str, Token] = dict()
+        self._own_executor: Optional[Executor] = None
+        self._callback_workers: Optional[int] = None
+        if isinstance(callback_executor, int):
+            self._callback_workers = callback_executor
+            callback_executor = self._own_executor = self._new_executor()
+        self._auth_callbacks = CallbackPipeline(callback_executor)
+        self._verify_callbacks = CallbackPipeline(callback_executor)
+        self._send_callbacks = CallbackPipeline(callback_executor)
+        self._publish_callbacks = CallbackPipeline(callback_executor)
+        self._tokens = TokenStore(
+            token_expire_seconds,
+            max_size=token_store_size,
+            prune_interval=token_prune_interval,
+        )
+        self._signer: Optional[TokenSigner] = None
+        if stateless_tokens:
+            self._signer = TokenSigner(app.config["SECRET_KEY"], token_expire_seconds)
+        self._index = NamespaceIndex()
+        self._shards: List[DeliveryShard] = [DeliveryShard(self) for _ in range(shards)]
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self._stats_route = stats_route
+        self.compressor = compressor
+        self.compression_threshold = compression_threshold
+        self.shutdown_timeout = shutdown_timeout
+        self.reconnect_after = reconnect_after
+        self.reconnect_jitter = reconnect_jitter
+        self.client_publish = client_publish
+        self.publish_rate = publish_rate
+        self.publish_burst = publish_burst
+        self._closing = False
+        self._drained: Optional[asyncio.Event] = None
+        self.admission = AdmissionController(
+            max_subscribers=max_subscribers,
+            max_subscribers_per_key=max_subscribers_per_session,
+            connect_rate=connect_rate,
+            connect_burst=connect_burst,
+        )
+        self.metrics = BrokerMetrics(self)
         super().__init__()
 
         if app:
@@ -100,55 +282,190 @@ class EventBroker(MultisubscriberQueue):
         """
         app.extensions["events"] = self
         app.register_blueprint(self.create_blueprint(), url_prefix=url_prefix)
+        app.before_serving(self._reopen)
+        app.after_serving(self.stop)
 
-    def auth(self, callable_: Callable) -> None:
-        self._auth_callbacks.append(callable_)
+    async def start(self) -> None:
+        """
+        Start the backend; this is done automatically by put() and subscribe()
 
-    def verify(self, callable_: Callable) -> None:
-        self._verify_callbacks.append(callable_)
+        """
+        if self._backend_started is None:
+            await self._reopen()
+            self._loop = asyncio.get_running_loop()
+            for _shard in self._shards:
+                _shard.start()
+            self._backend_started = asyncio.ensure_future(self.backend.start(self))
+        await self._backend_started
 
-    def send(self, callable_: Callable) -> None:
-        self._send_callbacks.append(callable_)
+    async def _reopen(self) -> None:
+        """
+        Accept subscribers again after a previous shutdown(); registered with
+        the app's before_serving hooks
 
-    @staticmethod
-    async def _execute_callbacks(callbacks: List[Callable], *args) -> None:
-        for _callable in callbacks:
-            if asyncio.iscoroutinefunction(_callable):
-                await _callable(*args)
-            else:
-                _callable(*args)
+        """
+        self._closing = False
+        self._drained = None
+        self.admission.closed = False
+
+    async def stop(self) -> None:
+        """
+        Shut down the subscribers and stop the backend; registered with the
+        app's after_serving hooks
+
+        """
+        await self.shutdown()
+        self._tokens.stop()
+        if self._own_executor is not None:
+            self._own_executor.shutdown(wait=False)
+            # the pool's threads are only started when a callback runs, so a
+            # fresh pool costs nothing until the app is served again
+            self._own_executor = self._new_executor()
+            for _pipeline in (
+                self._auth_callbacks,
+                self._verify_callbacks,
+                self._send_callbacks,
+                self._publish_callbacks,
+            ):
+                _pipeline.executor = self._own_executor
+        if self._backend_started is not None:
+            self._backend_started = None
+            await self.backend.stop()
+        for _shard in self._shards:
+            await _shard.stop()
+        if self.event_log is not None:
+            self.event_log.close()
+
+    async def shutdown(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop accepting subscribers and let the current ones finish
+
+        New connections are rejected. Every subscriber is sent the events
+        already on its queue followed by a "_close" event carrying a
+        jittered "reconnect_after" hint. Subscribers which have not finished
+        within the timeout have their remaining events discarded.
+
+        Parameters:
+            timeout (float): defaults to shutdown_timeout
+
+        """
+        self._closing = True
+        self.admission.closed = True
+        if not self.subscribers:
+            return
+
+        self._drained = asyncio.Event()
+        for _queue in list(self.subscribers):
+            # a full queue is not waiting; subscribe() stops once it is empty
+            if not _queue.full():
+                _queue.put_nowait(Shutdown)
+
+        _timeout = self.shutdown_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(self._drained.wait(), _timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"{len(self.subscribers)} subscribers did not finish within {_timeout}s"
+            )
+            for _queue in list(self.subscribers):
+                self._disconnect(_queue, Shutdown)
+
+    def _new_executor(self) -> Executor:
+        return ThreadPoolExecutor(
+            max_workers=self._callback_workers, thread_name_prefix="quart-events"
+        )
+
+    def _reconnect_after(self) -> float:
+        return self.reconnect_after + random.uniform(0, self.reconnect_jitter)
+
+    def auth(self, callable_: Callable) -> Callable:
+        return self._auth_callbacks.add(callable_)
+
+    def verify(self, callable_: Callable) -> Callable:
+        return self._verify_callbacks.add(callable_)
+
+    def send(self, callable_: Callable) -> Callable:
+        return self._send_callbacks.add(callable_)
+
+    def publish(self, callable_: Callable) -> Callable:
+        return self._publish_callbacks.add(callable_)
+
+    def callback_stats(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Call counts and timings for each registered callback
+
+        """
+        return {
+            "auth": self._auth_callbacks.stats(),
+            "verify": self._verify_callbacks.stats(),
+            "send": self._send_callbacks.stats(),
+            "publish": self._publish_callbacks.stats(),
+        }
 
     def _get_token_from_session(self) -> Token:
         _token = session.get("quart_events_token")
-        if _token:
+        if not _token:
+            return NullToken()
+        elif self._signer is not None:
+            return self._signer.unsign(_token)
+        elif isinstance(_token, dict):
             return Token(value=_token["value"], date=_token["date"])
         else:
             return NullToken()
 
+    def _admission_key(self, remote_addr: Optional[str]) -> str:
+        """
+        Identify the session for admission control without verifying its token
+
+        """
+        _token = session.get("quart_events_token")
+        if isinstance(_token, dict):
+            return str(_token.get("value"))
+        elif _token:
+            return str(_token)
+        return remote_addr or ""
+
     def _token_is_expired(self, token: Token) -> bool:
-        if type(token) is NullToken:
-            return True
+        return self._tokens.is_expired(token)
+
+    def _token_deadline(self, token: Token) -> float:
+        """
+        Convert the token's expiration to a time on the event loop's clock
 
-        _expire_time = datetime.utcnow() - timedelta(seconds=self._token_expire_seconds)
-        return token.date < _expire_time
+        """
+        _remaining = (
+            token.date
+            + timedelta(seconds=self._token_expire_seconds)
+            - datetime.utcnow()
+        )
+        return asyncio.get_running_loop().time() + _remaining.total_seconds()
 
-    def clear_expired_tokens(self):
-        for _key in list(self._tokens.keys()):
-            if self._token_is_expired(self._tokens[_key]):
-                del self._tokens[_key]
+    def clear_expired_tokens(self) -> None:
+        """
+        Remove expired tokens now instead of waiting for the background prune
 
-    async def authorize_websocket(self):
-        # gc expired tokens
-        self.clear_expired_tokens()
+        """
+        self._tokens.prune()
+
+    def token_stats(self) -> Dict[str, int]:
+        """
+        Counters for live, issued, expired and evicted tokens
+
+        """
+        return self._tokens.stats()
 
+    async def authorize_websocket(self):
         try:
-            await self._execute_callbacks(self._auth_callbacks)
+            await self._auth_callbacks()
 
             _token = self._get_token_from_session()
-            if _token is type(NullToken) or self._token_is_expired(_token):
+            if self._token_is_expired(_token):
                 _token = Token.new()
-                session["quart_events_token"] = asdict(_token)
-                self._tokens[str(_token.value)] = _token
+                if self._signer is not None:
+                    session["quart_events_token"] = self._signer.sign(_token)
+                else:
+                    session["quart_events_token"] = asdict(_token)
+                    self._tokens.add(_token)
         except Exception as e:
             if "quart_events_token" in session:
                 del session["quart_events_token"]
@@ -165,7 +482,7 @@ class EventBroker(MultisubscriberQueue):
         _token = self.verify_auth_token()
 
         # executes any additional verification callbacks
-        await self._execute_callbacks(self._verify_callbacks)
+        await self._verify_callbacks()
 
         return _token
 
@@ -198,83 +515,957 @@ class EventBroker(MultisubscriberQueue):
         @blueprint.websocket("/ws")
         @blueprint.websocket("/ws/<namespace>")
         async def ws(namespace: Optional[str] = None) -> Response:
+            # admission is checked before any auth callbacks
+            _key = self._admission_key(websocket.remote_addr)
+            _reason = self.admission.admit(_key)
+            if _reason is not None:
+                _payload: Any = self.codec.encode(
+                    {"event": "_rejected", "message": _reason}
+                )
+                await websocket.send(_payload)
+                return jsonify(error=_reason)
+
+            self.admission.acquire(_key)
+            try:
+                return await _ws(namespace)
+            finally:
+                self.admission.release(_key)
+
+        async def _ws(namespace: Optional[str] = None) -> Response:
+            # clients select a codec with the websocket subprotocol
+            _codec = self.codec
+            for _subprotocol in websocket.requested_subprotocols:
+                if _subprotocol in self._codecs:
+                    _codec = self._codecs[_subprotocol]
+                    await websocket.accept(subprotocol=_subprotocol)
+                    break
+
+            async def _send(data: Dict[str, Any]) -> None:
+                _payload: Any = _codec.encode(data)
+                await websocket.send(_payload)
+
+            # clients opt in to receiving large events as compressed binary frames
+            _compressor: Optional[Compressor] = None
+            if (
+                self.compressor is not None
+                and not _codec.binary
+                and self.compressor.name in websocket.args.get("compress", "").split(",")
+            ):
+                _compressor = self.compressor
+
+            def _frame(message: Message) -> Any:
+                _payload = (
+                    message.payload if _codec is self.codec else message.encode(_codec)
+                )
+                if _compressor and len(_payload) >= self.compression_threshold:
+                    return message.compress(_codec, _compressor, _payload)
+                return _payload
+
+            async def _send_batch(messages: List[Message]) -> None:
+                # compressed events are sent on their own between array frames
+                _frames: List[Any] = list()
+                for _message in messages:
+                    _payload = _frame(_message)
+                    if _compressor and isinstance(_payload, bytes):
+                        if _frames:
+                            _joined: Any = _codec.join(_frames)
+                            await websocket.send(_joined)
+                            _frames = list()
+                        await websocket.send(_payload)
+                    else:
+                        _frames.append(_payload)
+                if _frames:
+                    _joined = _codec.join(_frames)
+                    await websocket.send(_joined)
+
+            _expires: Optional[float] = None
             if self._auth_enabled:
                 try:
-                    _token = await self.verify_auth()
+                    _expires = self._token_deadline(await self.verify_auth())
                 except EventBrokerAuthError as e:
-                    await websocket.send_json({"event": "error", "message": str(e)})
+                    await _send({"event": "error", "message": str(e)})
                     return jsonify(error=str(e))
                 except Exception as e:
-                    await websocket.send_json(
-                        {"event": "error", "message": "not authorized"}
-                    )
+                    await _send({"event": "error", "message": "not authorized"})
                     return jsonify(error="not authorized")
 
-            # initial message
-            await websocket.send_json({"event": "_open"})
+            # clients opt in to receiving events as array frames
+            _batch = websocket.args.get("batch", "").lower() in ("1", "true")
+            # reconnecting clients pass the id of the last event they received
+            _since = websocket.args.get("since", type=int)
 
-            # enter subscriber loop
-            async for data in self.subscribe():
+            async def _receive() -> None:
+                # events published by the client are read alongside the subscriber loop
+                _bucket: Optional[TokenBucket] = None
+                if self.publish_rate is not None:
+                    _bucket = TokenBucket(self.publish_rate, self.publish_burst)
                 try:
-                    """
-                    KeepAlive:
-                        * dummy event send at a regular interval to keep the socket from closing
-                    Namespace:
-                        * if a namespace is given but the "event" field is not, skip this event.
-                        * if a namespace is given but does not match the "event" field, skip this event.
-                    """
-                    if self._token_is_expired(_token):
-                        await websocket.send_json(
-                            {"event": "_token_expire", "message": "token is expired"}
-                        )
-                        break
-                    elif data is KeepAlive:
-                        await websocket.send_json({"event": "_keepalive"})
-                    elif namespace and (
-                        data.get("event") is None
-                        or not data["event"].startswith(namespace)
-                    ):
-                        continue
-                    else:
-                        await self._execute_callbacks(self._send_callbacks, data)
-                        await websocket.send_json(data)
+                    while True:
+                        _payload = await websocket.receive()
+                        try:
+                            _data = _codec.decode(_payload)
+                        except Exception:
+                            _reason: Optional[str] = "invalid frame"
+                        else:
+                            try:
+                                _reason = await self._publish_from_client(
+                                    _data, _bucket
+                                )
+                            except Exception as e:
+                                logger.exception(e)
+                                _reason = "publish failed"
+                        if _reason is not None:
+                            self.metrics.publish_rejected[_reason] += 1
+                            await _send(
+                                {"event": "_publish_rejected", "message": _reason}
+                            )
                 except asyncio.CancelledError:
-                    break
+                    raise
                 except Exception as e:
                     logger.exception(e)
-                    logger.warning("ending subscriber loop")
-                    break
-            else:
-                # final message
-                await websocket.send_json({"event": "_close"})
+                    logger.warning("ending publish loop")
+
+            # initial message
+            await _send({"event": "_open"})
+            self.metrics.connections += 1
+
+            _receiver: Optional[asyncio.Task] = None
+            if self.client_publish:
+                _receiver = asyncio.create_task(_receive())
+
+            # enter subscriber loop
+            _cause = "cancel"
+            try:
+                async for message in self.subscribe(
+                    namespace, batch=_batch, since=_since, expires=_expires
+                ):
+                    try:
+                        """
+                        KeepAlive:
+                            * dummy event send at a regular interval to keep the socket from closing
+                        Namespace:
+                            * events are routed by the broker; only events whose "event" field
+                              matches one of the namespace's comma-separated prefixes or glob
+                              patterns are put on this subscriber's queue
+                        Batch:
+                            * a list of events is sent as a single array frame
+                        Resync:
+                            * the events since the requested id are no longer available
+                        TokenExpired:
+                            * put on the queue by a timer when the token expires
+                        Shutdown:
+                            * the broker is shutting down and the pending events have been sent
+                        """
+                        _control = self._control_event(message)
+                        if _control is not None:
+                            _end, _event = _control
+                            if message is KeepAlive:
+                                await websocket.send(_frame(self._keepalive_message))
+                            else:
+                                await _send(_event)
+                            if _end is not None:
+                                _cause = _end
+                                break
+                        elif isinstance(message, list):
+                            if self._send_callbacks:
+                                for _message in message:
+                                    await self._send_callbacks(_message.data)
+                            await _send_batch(message)
+                            for _message in message:
+                                self._record_sent(_message)
+                        else:
+                            if self._send_callbacks:
+                                await self._send_callbacks(message.data)
+                            await websocket.send(_frame(message))
+                            self._record_sent(message)
+                    except asyncio.CancelledError:
+                        break
+                    except Exception as e:
+                        _cause = "error"
+                        logger.exception(e)
+                        logger.warning("ending subscriber loop")
+                        break
+                else:
+                    # final message
+                    _cause = "close"
+                    await _send({"event": "_close"})
+            finally:
+                if _receiver is not None:
+                    _receiver.cancel()
+                self.metrics.disconnects[_cause] += 1
 
             return jsonify(message="socket has ended")
 
+        if self._stats_route:
+
+            @blueprint.route("/stats")
+            async def stats() -> Response:
+                if request.args.get("format") == "prometheus":
+                    return Response(
+                        self.metrics.prometheus(),
+                        content_type="text/plain; version=0.0.4; charset=utf-8",
+                    )
+                return jsonify(self.metrics.snapshot())
+
+        @blueprint.route("/sse")
+        @blueprint.route("/sse/<namespace>")
+        async def sse(namespace: Optional[str] = None) -> Response:
+            # admission is checked before any auth callbacks; the subscriber is
+            # counted from here until the stream ends
+            _key = self._admission_key(request.remote_addr)
+            _reason = self.admission.admit(_key)
+            if _reason is not None:
+                r = jsonify(event="_rejected", message=_reason)
+                r.status_code = 429 if _reason == "connect rate exceeded" else 503
+                return r
+            _release = self.admission.lease(_key)
+
+            _expires: Optional[float] = None
+            if self._auth_enabled:
+                try:
+                    _expires = self._token_deadline(await self.verify_auth())
+                except EventBrokerAuthError as e:
+                    _release()
+                    r = jsonify(error=str(e))
+                    r.status_code = 401
+                    return r
+                except Exception as e:
+                    _release()
+                    r = jsonify(error="not authorized")
+                    r.status_code = 401
+                    return r
+
+            # EventSource sends the id of the last event it received when it reconnects
+            _since = request.headers.get("Last-Event-ID", type=int)
+
+            @stream_with_context
+            async def _stream() -> AsyncGenerator[bytes, None]:
+                self.metrics.connections += 1
+                _cause = "cancel"
+                try:
+                    yield self._sse_frame({"event": "_open"})
+                    async for message in self.subscribe(
+                        namespace, since=_since, expires=_expires
+                    ):
+                        try:
+                            _control = self._control_event(message)
+                            if _control is not None:
+                                _end, _event = _control
+                                if message is KeepAlive:
+                                    yield b": keepalive\n\n"
+                                elif "reconnect_after" in _event:
+                                    # EventSource waits "retry" milliseconds to reconnect
+                                    _retry = int(_event["reconnect_after"] * 1000)
+                                    yield f"retry: {_retry}\n".encode(
+                                        self.encoding
+                                    ) + self._sse_frame(_event)
+                                else:
+                                    yield self._sse_frame(_event)
+                                if _end is not None:
+                                    _cause = _end
+                                    break
+                            else:
+                                if self._send_callbacks:
+                                    await self._send_callbacks(message.data)
+                                yield self._sse_frame(message)
+                                self._record_sent(message)
+                        except asyncio.CancelledError:
+                            break
+                        except Exception as e:
+                            _cause = "error"
+                            logger.exception(e)
+                            logger.warning("ending subscriber loop")
+                            break
+                    else:
+                        _cause = "close"
+                finally:
+                    _release()
+                    self.metrics.disconnects[_cause] += 1
+
+            _body = _stream()
+            # a body which is never iterated does not run its finally block
+            weakref.finalize(_body, _release)
+            _headers = Headers()
+            _headers["Cache-Control"] = "no-cache"
+            _headers["X-Accel-Buffering"] = "no"
+            _response = Response(_body, headers=_headers, mimetype="text/event-stream")
+            _response.timeout = None
+            return _response
+
         return blueprint
 
-    async def put(self, **data: Any) -> None:  # type: ignore
+    def _control_event(
+        self, message: Any
+    ) -> Optional[Tuple[Optional[str], Dict[str, Any]]]:
+        """
+        Map a sentinel yielded by subscribe() to the control event sent to the client
+
+        Returns:
+            None for events, otherwise a tuple of the disconnect cause (None
+            if the subscriber loop continues) and the control event
+
+        """
+        if message is KeepAlive:
+            return None, {"event": "_keepalive"}
+        elif message is Resync:
+            return None, {
+                "event": "_resync",
+                "message": "missed events are no longer available",
+            }
+        elif message is TokenExpired:
+            return "token_expire", {
+                "event": "_token_expire",
+                "message": "token is expired",
+            }
+        elif message is Overflow:
+            return "overflow", {
+                "event": "_overflow",
+                "message": "subscriber queue is full",
+            }
+        elif message is Shutdown:
+            return "shutdown", {
+                "event": "_close",
+                "reconnect_after": self._reconnect_after(),
+            }
+        return None
+
+    def _record_sent(self, message: Message) -> None:
+        self.metrics.sent += 1
+        self.metrics.latency.observe(time.monotonic() - message.created)
+
+    def _sse_frame(self, message: Any) -> bytes:
+        """
+        Format a Message (or a dict for control events) as a server-sent event
+
+        The pre-encoded payload is used as the data field.
+
+        """
+        if isinstance(message, Message):
+            _frame = f"data: {message.payload}\n\n"
+            if message.id is not None:
+                _frame = f"id: {message.id}\n{_frame}"
+        else:
+            _frame = f"data: {self.codec.encode(message)!s}\n\n"
+        return _frame.encode(self.encoding)
+
+    async def put(  # type: ignore
+        self, *, conflate_key: Optional[str] = None, **data: Any
+    ) -> None:
         """
         Put a new data on the event broker
 
+        The data is encoded once here and the Message is handed to the
+        backend; every subscriber receives the same Message instance. Nothing
+        is encoded if the backend is local and no subscriber's namespace
+        matches the event. When events are kept for replay the "_id" field is
+        reserved for their ids and EventBrokerError is raised if the data has
+        one.
+
+        Parameters:
+            conflate_key (str): latest-value-wins key; if an event with the same
+                key is still waiting on a subscriber's queue it is replaced by
+                this one instead of this one being appended
+
         """
+        await self._put(data, conflate_key)
+
+    async def _put(
+        self, data: Dict[str, Any], conflate_key: Optional[str] = None
+    ) -> None:
+        self._check_reserved(data)
         if "event" not in data:
             data["event"] = None
 
-        await super().put(data)
+        self.metrics.published += 1
+        if (
+            self.backend.local
+            and not self._retain
+            and not self._has_subscriber(data["event"])
+        ):
+            return
+
+        await self.start()
+        await self.backend.publish(Message.new(data, self.codec, conflate_key))
+
+    async def put_many(self, events: Iterable[Dict[str, Any]]) -> None:
+        """
+        Put several events on the event broker in a single fan-out pass
+
+        Each subscriber receives the events matching its namespace as one
+        list in one queue operation; batching subscribers send the list as a
+        single frame.
+
+        Parameters:
+            events: dicts of event data, as would be passed to put()
 
-    async def subscribe(self) -> AsyncGenerator:
         """
-        Override subscribe() to add a timeout for the keepalive event
+        events = list(events)
+        for _data in events:
+            self._check_reserved(_data)
+
+        _local = self.backend.local and not self._retain
+        _messages = list()
+        for _data in events:
+            if "event" not in _data:
+                _data = {**_data, "event": None}
+            self.metrics.published += 1
+            if _local and not self._has_subscriber(_data["event"]):
+                continue
+            _messages.append(Message.new(_data, self.codec))
 
+        if _messages:
+            await self.start()
+            await self.backend.publish_many(_messages)
+
+    async def _publish_from_client(
+        self, data: Any, bucket: Optional[TokenBucket] = None
+    ) -> Optional[str]:
         """
-        with self.queue() as q:
+        Check and publish a frame of events received from a websocket client
+
+        The frame is rejected as a whole if it is malformed, exceeds the
+        connection's publish rate or any of its events is refused by a
+        publish callback. A single event may carry a "conflate_key", which is
+        removed from the event and passed to put(); events in an array may
+        not.
+
+        Parameters:
+            data: a decoded frame; an event dict or a list of event dicts
+            bucket (quart_events.admission.TokenBucket): the connection's
+                publish rate limit
+
+        Returns:
+            None if the events were published or the reason they were rejected
+
+        """
+        _events = data if isinstance(data, list) else [data]
+        if not _events or len(_events) > self.batch_max_size:
+            return "invalid frame"
+        for _event in _events:
+            if not isinstance(_event, dict) or not isinstance(_event.get("event"), str):
+                return "invalid frame"
+            if _event["event"].startswith("_") or (self._retain and "_id" in _event):
+                # reserved for events and ids sent by the broker
+                return "reserved event name"
+            if "conflate_key" in _event and (
+                isinstance(data, list) or not isinstance(_event["conflate_key"], str)
+            ):
+                # put_many() does not conflate
+                return "invalid frame"
+
+        if bucket is not None and not bucket.take(len(_events)):
+            return "publish rate exceeded"
+
+        try:
+            for _event in _events:
+                await self._publish_callbacks(_event)
+        except EventBrokerAuthError as e:
+            return str(e) or "not authorized"
+        except Exception as e:
+            logger.exception(e)
+            return "not authorized"
+
+        self.metrics.client_published += len(_events)
+        if isinstance(data, list):
+            await self.put_many(_events)
+        else:
+            # a single event may be conflated like any other put()
+            _conflate_key = data.pop("conflate_key", None)
+            await self._put(data, _conflate_key)
+        return None
+
+    def put_threadsafe(self, **data: Any) -> None:
+        """
+        Put new data on the event broker from any thread without blocking
+
+        The data is appended to a buffer and the event loop is woken at most
+        once per drain; everything buffered by then is published with
+        put_many(). The broker must have been started (by serving a
+        subscriber, calling put() or awaiting start()) so its loop is known.
+
+        """
+        if self._loop is None:
+            raise EventBrokerError("the broker has not been started on an event loop")
+        self._check_reserved(data)
+
+        with self._pending_lock:
+            self._pending.append(data)
+            if self._drain_scheduled:
+                return
+            self._drain_scheduled = True
+        self._loop.call_soon_threadsafe(self._drain_pending)
+
+    def _drain_pending(self) -> None:
+        with self._pending_lock:
+            _events, self._pending = self._pending, list()
+            self._drain_scheduled = False
+
+        _task = asyncio.create_task(self.put_many(_events))
+        self._drain_tasks.add(_task)
+        _task.add_done_callback(self._drain_tasks.discard)
+
+    def _check_reserved(self, data: Dict[str, Any]) -> None:
+        if self._retain and "_id" in data:
+            raise EventBrokerError(
+                '"_id" is reserved for the event ids set by the broker'
+            )
+
+    def _stamp(self, message: Message, now: float) -> Message:
+        """
+        Stamp the Message with the next sequence id and add it to the replay buffer
+
+        """
+        self._last_id += 1
+        message = message.stamp(self._last_id, self.codec)
+        if self.replay_size:
+            self._replay.append((now, message))
+        if self.event_log is not None:
+            self.event_log.append(message)
+        return message
+
+    async def deliver(self, message: Message) -> None:
+        """
+        Put a Message on the queue of every local subscriber it matches
+
+        This is called by the backend. When replay is enabled the Message is
+        stamped with the next sequence id and kept in the replay buffer.
+
+        """
+        _now = asyncio.get_running_loop().time()
+        if self._retain:
+            message = self._stamp(message, _now)
+            self._expire_replay(_now)
+
+        self.metrics.count_event(message.event)
+        if self._shards:
+            for _shard in self._shards:
+                _shard.put_nowait(message)
+                await asyncio.sleep(0)
+        else:
+            await self._fan_out(self._index, message, _now)
+
+    async def _fan_out(
+        self, index: NamespaceIndex, message: Message, now: float
+    ) -> None:
+        """
+        Put a Message on the queue of every subscriber in the index it matches
+
+        """
+        _queues = list(index.match(message.event))
+        if not _queues:
+            return
+
+        self.metrics.delivered += len(_queues)
+
+        for _queue in _queues:
+            if message.id is not None and message.id <= _queue.replayed_id:
+                # already sent from the replay buffer
+                continue
+            _queue.last_active = now
+            if message.conflate_key is not None and _queue.conflate(message):
+                self.metrics.conflated += 1
+            elif _queue.full():
+                await self._overflow(_queue, message)
+            else:
+                _queue.put_nowait(message)
+
+    async def deliver_many(self, messages: List[Message]) -> None:
+        """
+        Put a list of Messages on the queues of the local subscribers
+
+        Every subscriber receives the Messages matching its namespace as a
+        single list.
+
+        """
+        _now = asyncio.get_running_loop().time()
+        if self._retain:
+            messages = [self._stamp(_message, _now) for _message in messages]
+            self._expire_replay(_now)
+
+        for _message in messages:
+            self.metrics.count_event(_message.event)
+        if self._shards:
+            for _shard in self._shards:
+                _shard.put_nowait(messages)
+                await asyncio.sleep(0)
+        else:
+            await self._fan_out_many(self._index, messages, _now)
+
+    async def _fan_out_many(
+        self, index: NamespaceIndex, messages: List[Message], now: float
+    ) -> None:
+        """
+        Put the Messages matching each subscriber in the index on its queue as one list
+
+        """
+        _batches: Dict[SubscriberQueue, List[Message]] = dict()
+        for _message in messages:
+            for _queue in index.match(_message.event):
+                if _message.id is not None and _message.id <= _queue.replayed_id:
+                    continue
+                if _queue in _batches:
+                    _batches[_queue].append(_message)
+                else:
+                    _batches[_queue] = [_message]
+
+        for _queue, _batch in _batches.items():
+            self.metrics.delivered += len(_batch)
+            _queue.last_active = now
+            # the queue's size is counted in events; what does not fit is
+            # handed to the overflow policy
+            _room = (
+                len(_batch)
+                if _queue.maxsize <= 0
+                else _queue.maxsize - _queue.qsize()
+            )
+            if _room > 0:
+                _queue.put_nowait(_batch[:_room])
+            if _room < len(_batch):
+                await self._overflow(_queue, _batch[max(_room, 0) :])
+
+    def _has_subscriber(self, event: Optional[str]) -> bool:
+        if self._shards:
+            return any(any(_shard.index.match(event)) for _shard in self._shards)
+        return any(self._index.match(event))
+
+    def _disconnect(self, queue: SubscriberQueue, reason: object) -> None:
+        """
+        Stop routing events to the subscriber and leave only the reason on its queue
+
+        """
+        queue.index.remove(queue, queue.namespace)
+        queue.drain()
+        queue.put_nowait(reason)
+
+    def _expire_replay(self, now: float) -> None:
+        if self.replay_seconds is not None:
+            _oldest = now - self.replay_seconds
+            while self._replay and self._replay[0][0] < _oldest:
+                self._replay.popleft()
+
+    def replay(
+        self, since: int, namespace: Optional[str] = None
+    ) -> Optional[List[Message]]:
+        """
+        Get the buffered events which came after the given id
+
+        The replay buffer is used if it still holds the events after the id;
+        otherwise they are read from the event log. The log is read here in
+        one pass; subscribe() reads it in chunks instead.
+
+        Returns:
+            the matching messages or None if events after the id have
+            already been evicted from the buffer and the log (or replay is
+            disabled)
+
+        """
+        _chunks = self._replay_chunks(since, namespace)
+        if _chunks is None:
+            return None
+
+        _messages: List[Message] = list()
+        for _chunk in _chunks:
+            if _chunk is None:
+                return None
+            _messages.extend(_chunk)
+        return _messages
+
+    def _replay_chunks(
+        self, since: int, namespace: Optional[str] = None
+    ) -> Optional[Iterator[Optional[List[Message]]]]:
+        """
+        Get the events after the given id as lists of matching messages
+
+        Events from the replay buffer are read immediately and returned as a
+        single list. Events from the log are read lazily, replay_chunk_size
+        records per list, up to the last id when this was called. A None
+        chunk means the log's remaining events were deleted while reading.
+
+        Returns:
+            None if events after the id are no longer available
+
+        """
+        if not self._retain or since > self._last_id:
+            return None
+        if since == self._last_id:
+            return iter([])
+
+        _subscription = parse_subscription(namespace)
+        if self.replay_size:
+            self._expire_replay(asyncio.get_running_loop().time())
+            _first = self._replay[0][1].id if self._replay else None
+            if _first is not None and _first - 1 <= since:
+                return iter(
+                    [
+                        [
+                            _message
+                            for _, _message in self._replay
+                            if _message.id is not None
+                            and _message.id > since
+                            and _subscription.matches(_message.event)
+                        ]
+                    ]
+                )
+
+        if self.event_log is not None:
+            _first = self.event_log.first_id
+            if _first is not None and _first - 1 <= since:
+                return self._read_log(since, self._last_id, _subscription)
+
+        return None
+
+    def _read_log(
+        self, since: int, until: int, subscription: Subscription
+    ) -> Iterator[Optional[List[Message]]]:
+        assert self.event_log is not None
+        _expected = since + 1
+        _chunk: List[Message] = list()
+        for _message in self.event_log.read(since, self.codec):
+            if _message.id != _expected:
+                # the segment holding the next events has been deleted
+                yield None
+                return
+            if subscription.matches(_message.event):
+                _chunk.append(_message)
+            if _expected == until:
+                break
+            if (_expected - since) % self.replay_chunk_size == 0:
+                yield _chunk
+                _chunk = list()
+            _expected += 1
+        else:
+            yield None
+            return
+        yield _chunk
+
+    async def _overflow(
+        self, queue: SubscriberQueue, message: Union[Message, List[Message]]
+    ) -> None:
+        """
+        Apply the overflow policy to a full subscriber queue
+
+        A list of Messages is handled per event: "drop_oldest" keeps its
+        newest events and "block" puts them as room becomes available.
+
+        """
+        _count = len(message) if isinstance(message, list) else 1
+        queue.overflows += _count
+        self.overflow_counts[self.overflow_policy.value] += _count
+
+        if self.overflow_policy is OverflowPolicy.DROP_OLDEST:
+            if isinstance(message, list):
+                message = message[-queue.maxsize :]
+                _count = len(message)
+            while not queue.empty() and queue.qsize() + _count > queue.maxsize:
+                queue.get_nowait()
+            queue.put_nowait(message)
+        elif self.overflow_policy is OverflowPolicy.DISCONNECT:
+            self._disconnect(queue, Overflow)
+        elif self.overflow_policy is OverflowPolicy.BLOCK:
+            try:
+                await asyncio.wait_for(
+                    self._put_blocking(queue, message), self.overflow_timeout
+                )
+            except asyncio.TimeoutError:
+                self.overflow_counts["block_timeout"] += 1
+
+    async def _put_blocking(
+        self, queue: SubscriberQueue, message: Union[Message, List[Message]]
+    ) -> None:
+        """
+        Wait for room on the queue and put the Message or the list's events
+        in as many parts as needed to stay within the queue's size
+
+        """
+        if not isinstance(message, list):
+            await queue.put(message)
+            return
+
+        while message:
+            _room = queue.maxsize - queue.qsize()
+            if _room <= 0:
+                # waits until the queue has room for one more event
+                await queue.put(message[:1])
+                message = message[1:]
+            else:
+                queue.put_nowait(message[:_room])
+                message = message[_room:]
+
+    async def close(self) -> None:
+        """
+        Force all subscribers to end iteration
+
+        """
+        for _queue in list(self.subscribers):
+            if _queue.full():
+                _queue.get_nowait()
+            _queue.put_nowait(StopAsyncIteration)
+
+    @contextmanager
+    def queue(
+        self, namespace: Optional[str] = None, expires: Optional[float] = None
+    ) -> Generator:
+        """
+        Get a new subscriber queue which only receives events matching the namespace
+
+        Parameters:
+            namespace (str): only receive events matching these comma-separated
+                prefixes or glob patterns, e.g. "orders:*,inventory:low_*"
+            expires (float): loop time at which the queue's pending events are
+                replaced with TokenExpired
+
+        """
+        _queue = SubscriberQueue(namespace=namespace, maxsize=self.max_queue_size)
+        _shard: Optional[DeliveryShard] = None
+        if self._shards:
+            _shard = min(self._shards, key=lambda _candidate: _candidate.subscribers)
+            _shard.subscribers += 1
+            _queue.index = _shard.index
+        else:
+            _queue.index = self._index
+        self.subscribers.append(_queue)
+        _queue.index.add(_queue, namespace)
+        self._start_keepalive()
+        _timer: Optional[asyncio.TimerHandle] = None
+        if expires is not None:
+            _timer = asyncio.get_running_loop().call_at(
+                expires, self._disconnect, _queue, TokenExpired
+            )
+        try:
+            yield _queue
+        finally:
+            if _timer:
+                _timer.cancel()
+            _queue.index.remove(_queue, namespace)
+            if _shard is not None:
+                _shard.subscribers -= 1
+            self.subscribers.remove(_queue)
+            if not self.subscribers:
+                if self._keepalive_task:
+                    # the cancelled task may not have exited yet; forget it so
+                    # the next subscriber starts a new one
+                    self._keepalive_task.cancel()
+                    self._keepalive_task = None
+                if self._drained is not None:
+                    self._drained.set()
+
+    def _start_keepalive(self) -> None:
+        if self._keepalive_task is None or self._keepalive_task.done():
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+
+    async def _keepalive_loop(self) -> None:
+        """
+        Put KeepAlive on every subscriber queue which has been idle for the
+        keepalive interval
+
+        A single task serves all subscribers; it sleeps until the next
+        subscriber is due and exits once there are no subscribers left.
+
+        """
+        _loop = asyncio.get_running_loop()
+        while self.subscribers:
+            _now = _loop.time()
+            _next = _now + self.keepalive
+            for _queue in self.subscribers:
+                _due = _queue.last_active + self.keepalive
+                if _due <= _now:
+                    _queue.last_active = _now
+                    if not _queue.full():
+                        _queue.put_nowait(KeepAlive)
+                    _due = _now + self.keepalive
+                _next = min(_next, _due)
+            await asyncio.sleep(_next - _now)
+
+    async def subscribe(
+        self,
+        namespace: Optional[str] = None,
+        batch: bool = False,
+        since: Optional[int] = None,
+        expires: Optional[float] = None,
+    ) -> AsyncGenerator:
+        """
+        Yield events as they are put on the broker
+
+        KeepAlive is yielded when no events have been put for the keepalive
+        interval, Overflow is yielded when the subscriber was disconnected
+        by the "disconnect" overflow policy, TokenExpired is yielded once
+        the expires deadline has passed and Shutdown is yielded after the
+        pending events once the broker is shutting down.
+
+        Parameters:
+            namespace (str): only receive events matching these comma-separated
+                prefixes or glob patterns, e.g. "orders:*,inventory:low_*"
+            batch (bool): yield lists of up to batch_max_size messages which
+                arrived within batch_max_delay of each other
+            since (int): first yield the buffered events after this id; Resync
+                is yielded instead if they are no longer available
+            expires (float): loop time at which TokenExpired is yielded in place
+                of any pending events
+
+        """
+        await self.start()
+        _loop = asyncio.get_running_loop()
+        with self.queue(namespace, expires=expires) as q:
+            # the queue is registered before the replay is read; events after
+            # replayed_id arrive on the queue and the replay stops at it, so no
+            # event is missed or sent twice
+            if since is not None:
+                # events still waiting in the shards' inboxes are skipped
+                q.replayed_id = self._last_id
+                _chunks = self._replay_chunks(since, namespace)
+                if _chunks is None:
+                    yield Resync
+                else:
+                    for _messages in _chunks:
+                        if _messages is None:
+                            yield Resync
+                            break
+                        if batch:
+                            for i in range(0, len(_messages), self.batch_max_size):
+                                yield _messages[i : i + self.batch_max_size]
+                        else:
+                            for _message in _messages:
+                                yield _message
+                        # events from the log are read a chunk at a time
+                        await asyncio.sleep(0)
+
             while True:
-                try:
-                    _value = await asyncio.wait_for(q.get(), self.keepalive)
-                except asyncio.TimeoutError:
-                    yield KeepAlive
+                if self._closing and q.empty():
+                    yield Shutdown
+                    break
+
+                _value = await q.get()
+                if isinstance(_value, list) and not batch:
+                    # events from put_many()
+                    for _message in _value:
+                        yield _message
+                    continue
+                elif batch and isinstance(_value, (Message, list)):
+                    _batch = _value if isinstance(_value, list) else [_value]
+                    _value = None
+                    _deadline = _loop.time() + self.batch_max_delay
+                    while len(_batch) < self.batch_max_size:
+                        if q.empty():
+                            _remaining = _deadline - _loop.time()
+                            if _remaining <= 0:
+                                break
+                            await asyncio.sleep(_remaining)
+                            if q.empty():
+                                break
+                        _next = q.get_nowait()
+                        if isinstance(_next, Message):
+                            _batch.append(_next)
+                        elif isinstance(_next, list):
+                            _batch.extend(_next)
+                        else:
+                            # sentinels are yielded after the batch
+                            _value = _next
+                            break
+                    yield _batch
+                    if _value is None:
+                        continue
+
+                if _value is StopAsyncIteration:
+                    break
                 else:
-                    if _value is StopAsyncIteration:
-                        break
-                    else:
-                        yield _value
+                    yield _value
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import time
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class CallbackStats:
+    calls: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class CallbackPipeline:
+    """
+    Ordered callbacks which are classified once when they are registered
+
+    Coroutine functions are awaited on the event loop. Regular functions are
+    called inline or, when an executor is given, run in the executor so a
+    slow hook does not block the loop. The context of the caller (including
+    the quart request/websocket context) is copied into the executor thread.
+
+    Parameters:
+        executor (concurrent.futures.Executor): optional executor for sync callbacks
+
+    """
+
+    def __init__(self, executor: Optional[Executor] = None) -> None:
+        self.executor = executor
+        self._callbacks: List[Tuple[Callable, bool, CallbackStats]] = list()
+
+    def __len__(self) -> int:
+        return len(self._callbacks)
+
+    def add(self, callable_: Callable) -> Callable:
+        self._callbacks.append(
+            (callable_, asyncio.iscoroutinefunction(callable_), CallbackStats())
+        )
+        return callable_
+
+    async def __call__(self, *args: Any) -> None:
+        for _callable, _is_coroutine, _stats in self._callbacks:
+            _start = time.perf_counter()
+            try:
+                if _is_coroutine:
+                    await _callable(*args)
+                elif self.executor is None:
+                    _callable(*args)
+                else:
+                    _context = contextvars.copy_context()
+                    await asyncio.get_running_loop().run_in_executor(
+                        self.executor,
+                        _context.run,
+                        functools.partial(_callable, *args),
+                    )
+            except BaseException:
+                _stats.errors += 1
+                raise
+            finally:
+                _elapsed = time.perf_counter() - _start
+                _stats.calls += 1
+                _stats.total_seconds += _elapsed
+                if _elapsed > _stats.max_seconds:
+                    _stats.max_seconds = _elapsed
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Timing stats keyed by the callback's qualified name
+
+        """
+        return {
+            getattr(_callable, "__qualname__", repr(_callable)): asdict(_stats)
+            for _callable, _, _stats in self._callbacks
+        }
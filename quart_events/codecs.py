@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import struct
+from typing import TYPE_CHECKING
+
+from quart import json
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import msgpack  # type: ignore
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Type, Union
+
+
+SUBPROTOCOL_PREFIX = "quart-events."
+
+
+class Codec:
+    """
+    Encodes event data into websocket frames
+
+    Attributes:
+        name (str): clients select the codec with the websocket subprotocol
+            "quart-events.<name>"
+        binary (bool): True if frames are bytes rather than text
+
+    """
+
+    name: str
+    binary: bool = False
+
+    @property
+    def subprotocol(self) -> str:
+        return f"{SUBPROTOCOL_PREFIX}{self.name}"
+
+    def encode(self, data: Any) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def decode(self, payload: Union[str, bytes]) -> Any:
+        raise NotImplementedError
+
+    def join(self, frames: List[Any]) -> Union[str, bytes]:
+        """
+        Combine already encoded frames into a single array frame
+
+        """
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """
+    The standard library json module (with quart's handling of dates, UUIDs
+    and dataclasses)
+
+    """
+
+    name = "json"
+
+    def encode(self, data: Any) -> str:
+        return json.dumps(data)
+
+    def decode(self, payload: Union[str, bytes]) -> Any:
+        return json.loads(payload)  # type: ignore[arg-type]
+
+    def join(self, frames: List[Any]) -> str:
+        return f"[{','.join(frames)}]"
+
+
+class OrjsonCodec(JsonCodec):
+    """
+    orjson; the frames are the same json text as JsonCodec's
+
+    """
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        if orjson is None:
+            raise RuntimeError("orjson is not installed")
+
+    def encode(self, data: Any) -> str:
+        return orjson.dumps(data).decode("utf-8")
+
+    def decode(self, payload: Union[str, bytes]) -> Any:
+        return orjson.loads(payload)
+
+
+class MsgpackCodec(Codec):
+    """
+    msgpack; frames are sent as binary websocket messages
+
+    """
+
+    name = "msgpack"
+    binary = True
+
+    def __init__(self) -> None:
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+
+    def encode(self, data: Any) -> bytes:
+        return msgpack.packb(data, default=str)
+
+    def decode(self, payload: Union[str, bytes]) -> Any:
+        return msgpack.unpackb(payload)
+
+    def join(self, frames: List[Any]) -> bytes:
+        _length = len(frames)
+        if _length < 16:
+            _header = struct.pack("!B", 0x90 | _length)
+        elif _length < 2**16:
+            _header = struct.pack("!BH", 0xDC, _length)
+        else:
+            _header = struct.pack("!BI", 0xDD, _length)
+        return _header + b"".join(frames)
+
+
+CODECS: Dict[str, Type[Codec]] = {
+    JsonCodec.name: JsonCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    MsgpackCodec.name: MsgpackCodec,
+}
+
+
+def get_codec(name: str) -> Codec:
+    """
+    Create a codec by name
+
+    """
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"unknown codec: {name}")
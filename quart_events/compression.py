@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import zlib
+from typing import TYPE_CHECKING
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+if TYPE_CHECKING:
+    from typing import Dict, Optional, Type
+
+
+class Compressor:
+    """
+    Compresses encoded event frames
+
+    Attributes:
+        name (str): clients opt in with "?compress=<name>"
+
+    """
+
+    name: str
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    """
+    zlib from the standard library
+
+    """
+
+    name = "zlib"
+
+    def __init__(self, level: int = 6) -> None:
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class ZstdCompressor(Compressor):
+    """
+    zstandard; frames carry their content size
+
+    """
+
+    name = "zstd"
+
+    def __init__(self, level: int = 3) -> None:
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed")
+        self.level = level
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+
+COMPRESSORS: Dict[str, Type[Compressor]] = {
+    ZlibCompressor.name: ZlibCompressor,
+    ZstdCompressor.name: ZstdCompressor,
+}
+
+
+def get_compressor(name: Optional[str] = None) -> Compressor:
+    """
+    Create a compressor by name; without a name zstd is used if it is
+    installed and zlib otherwise
+
+    """
+    if name is None:
+        name = ZstdCompressor.name if zstandard is not None else ZlibCompressor.name
+    try:
+        return COMPRESSORS[name]()
+    except KeyError:
+        raise ValueError(f"unknown compressor: {name}")
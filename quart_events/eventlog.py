@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from bisect import bisect_right
+from typing import TYPE_CHECKING
+
+from .message import Message
+
+
+if TYPE_CHECKING:
+    from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+    from .codecs import Codec
+
+
+logger = logging.getLogger(__name__)
+
+
+# event id, payload length, crc32 of the payload
+_header = struct.Struct("!QII")
+
+
+def _records(
+    view: memoryview, verify: bool = False
+) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yield the id, start and end offset of every record in a segment
+
+    Stops at the first incomplete (or, when verifying, corrupt) record.
+
+    """
+    _offset = 0
+    _size = len(view)
+    while _offset + _header.size <= _size:
+        _id, _length, _crc = _header.unpack_from(view, _offset)
+        _start = _offset + _header.size
+        _end = _start + _length
+        if _end > _size:
+            return
+        if verify and zlib.crc32(view[_start:_end]) != _crc:
+            return
+        yield _id, _start, _end
+        _offset = _end
+
+
+class EventLog:
+    """
+    Durable append-only log of stamped events
+
+    Events are appended to segment files named after the id of their first
+    event. Appends are written immediately and flushed and fsynced together
+    every fsync_interval seconds. A new segment is started once the active
+    one reaches segment_bytes; closed segments are deleted oldest first once
+    the log exceeds max_bytes or they are older than max_age. Retention is
+    checked when a segment is closed and every expire_interval seconds,
+    using sizes and close times kept in memory.
+
+    Segments are read through mmap; only the events after the requested id
+    are decoded. When the log is opened the last segment is checked and a
+    partially written tail left by a crash is truncated.
+
+    Parameters:
+        path (str): directory holding the segments
+        segment_bytes (int): size at which a new segment is started
+        max_bytes (int): maximum total size of the log; None means unlimited
+        max_age (float): seconds after which a closed segment is deleted;
+            None means never
+        fsync_interval (float): seconds between flushes of appended events
+        expire_interval (float): seconds between retention checks of a log
+            which is not rotating
+
+    """
+
+    suffix = ".log"
+
+    def __init__(
+        self,
+        path: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+        fsync_interval: float = 0.05,
+        expire_interval: float = 60.0,
+    ) -> None:
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync_interval = fsync_interval
+        self.expire_interval = expire_interval
+        self.last_id: Optional[int] = None
+        self._segments: List[int] = list()
+        self._file: Optional[BinaryIO] = None
+        self._size: int = 0
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+        # size and close time of every segment but the active one
+        self._closed: Dict[int, Tuple[int, float]] = dict()
+        self._closed_bytes: int = 0
+        self._next_expire: float = 0.0
+
+        os.makedirs(path, exist_ok=True)
+        self._segments = sorted(
+            int(_name[: -len(self.suffix)])
+            for _name in os.listdir(path)
+            if _name.endswith(self.suffix) and _name[: -len(self.suffix)].isdigit()
+        )
+        self._recover()
+        for _first in self._segments[:-1]:
+            _path = self._segment_path(_first)
+            self._close_segment(
+                _first, os.path.getsize(_path), os.path.getmtime(_path)
+            )
+
+    @property
+    def first_id(self) -> Optional[int]:
+        if self.last_id is None or not self._segments:
+            return None
+        return self._segments[0]
+
+    def _segment_path(self, first_id: int) -> str:
+        return os.path.join(self.path, f"{first_id:020d}{self.suffix}")
+
+    def _recover(self) -> None:
+        """
+        Find the last event and truncate a partially written tail
+
+        """
+        while self._segments:
+            _path = self._segment_path(self._segments[-1])
+            _valid, _last_id = self._scan(_path)
+            if _last_id is None:
+                # nothing usable in the segment
+                os.unlink(_path)
+                self._segments.pop()
+                continue
+
+            if _valid < os.path.getsize(_path):
+                logger.warning(f"truncating incomplete events at the end of {_path}")
+                with open(_path, "r+b") as f:
+                    f.truncate(_valid)
+                    os.fsync(f.fileno())
+
+            self.last_id = _last_id
+            self._file = open(_path, "ab")
+            self._size = _valid
+            return
+
+    def _scan(self, path: str) -> Tuple[int, Optional[int]]:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return 0, None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as _mmap:
+                with memoryview(_mmap) as _view:
+                    _valid, _last_id = 0, None
+                    for _last_id, _, _valid in _records(_view, verify=True):
+                        pass
+                    return _valid, _last_id
+
+    def append(self, message: Message) -> None:
+        """
+        Write a stamped Message to the active segment
+
+        """
+        assert message.id is not None
+        if self._file is None or self._size >= self.segment_bytes:
+            self._rotate(message.id)
+        assert self._file is not None
+
+        _payload = message.payload.encode("utf-8")
+        _record = _header.pack(message.id, len(_payload), zlib.crc32(_payload))
+        self._file.write(_record + _payload)
+        self._size += len(_record) + len(_payload)
+        self.last_id = message.id
+        self._dirty = True
+        self._start()
+
+    def _close_segment(self, first_id: int, size: int, closed: float) -> None:
+        self._closed[first_id] = (size, closed)
+        self._closed_bytes += size
+
+    def _rotate(self, first_id: int) -> None:
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._close_segment(self._segments[-1], self._size, time.time())
+        self._segments.append(first_id)
+        self._file = open(self._segment_path(first_id), "ab")
+        self._size = 0
+        self.expire()
+
+    def expire(self) -> None:
+        """
+        Delete closed segments beyond max_bytes or older than max_age
+
+        """
+        if self.max_bytes is None and self.max_age is None:
+            return
+
+        _now = time.time()
+        while len(self._segments) > 1:
+            _first = self._segments[0]
+            _size, _closed = self._closed[_first]
+            if not (
+                (
+                    self.max_bytes is not None
+                    and self._closed_bytes + self._size > self.max_bytes
+                )
+                or (self.max_age is not None and _now - _closed > self.max_age)
+            ):
+                break
+            try:
+                os.unlink(self._segment_path(_first))
+            except FileNotFoundError:
+                pass
+            self._segments.pop(0)
+            del self._closed[_first]
+            self._closed_bytes -= _size
+
+    def read(self, since: int, codec: Codec) -> Iterator[Message]:
+        """
+        Yield the logged events after the given id
+
+        """
+        self.flush()
+        _index = max(0, bisect_right(self._segments, since + 1) - 1)
+        for _first in self._segments[_index:]:
+            try:
+                f = open(self._segment_path(_first), "rb")
+            except FileNotFoundError:
+                # expired while reading
+                continue
+            with f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as _mmap:
+                    with memoryview(_mmap) as _view:
+                        for _id, _start, _end in _records(_view):
+                            if _id > since:
+                                yield Message.decode(
+                                    str(_view[_start:_end], "utf-8"), codec, id=_id
+                                )
+
+    def flush(self) -> None:
+        """
+        Write buffered events to the active segment without waiting for fsync
+
+        """
+        if self._file is not None:
+            self._file.flush()
+
+    def _start(self) -> None:
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                # no running loop; events are synced on close()
+                pass
+
+    async def _run(self) -> None:
+        _loop = asyncio.get_running_loop()
+        while self._dirty:
+            await asyncio.sleep(self.fsync_interval)
+            if self._file is None:
+                break
+            self._dirty = False
+            self._file.flush()
+            # events appended while this runs are synced by the next pass
+            try:
+                await _loop.run_in_executor(None, os.fsync, self._file.fileno())
+            except OSError:
+                # the segment was rotated, which syncs it
+                pass
+            if _loop.time() >= self._next_expire:
+                self._next_expire = _loop.time() + self.expire_interval
+                self.expire()
+
+    def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
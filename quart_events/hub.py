@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import struct
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from typing import Optional, Set
+
+
+logger = logging.getLogger(__name__)
+
+
+_header = struct.Struct("!I")
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    """
+    Read one length-prefixed frame
+
+    Raises asyncio.IncompleteReadError when the connection is closed.
+
+    """
+    _header_bytes = await reader.readexactly(_header.size)
+    (_length,) = _header.unpack(_header_bytes)
+    return await reader.readexactly(_length)
+
+
+def pack_frame(payload: bytes) -> bytes:
+    return _header.pack(len(payload)) + payload
+
+
+class Hub:
+    """
+    Fan events out between the worker processes of one machine
+
+    Every worker connects to the hub over a unix domain socket. A frame
+    received from one worker is written unchanged to every other worker, so
+    the event payload is encoded once by the publishing worker and never
+    re-encoded by the hub.
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    async def __aenter__(self) -> Hub:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.stop()
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        logger.debug(f"hub is listening on {self.path}")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for _writer in list(self._writers):
+            _writer.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        assert self._server
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        try:
+            while True:
+                _frame = pack_frame(await read_frame(reader))
+                _peers = [_writer for _writer in self._writers if _writer is not writer]
+                for _peer in _peers:
+                    _peer.write(_frame)
+                await asyncio.gather(
+                    *[_peer.drain() for _peer in _peers], return_exceptions=True
+                )
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="quart-events fan-out hub")
+    parser.add_argument("path", help="path of the unix domain socket")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(Hub(args.path).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, Optional, Union
+
+
+if TYPE_CHECKING:
+    from .codecs import Codec
+    from .compression import Compressor
+
+
+@dataclass(frozen=True)
+class Message:
+    """
+    An event as it is handed to subscribers
+
+    The payload is encoded a single time with the broker's codec when the
+    event is put on the broker and the same frame is then sent to every
+    subscribed websocket. Frames for other codecs are encoded on first use
+    and cached.
+
+    The monotonic time the Message was created is kept so the broker can
+    measure how long events take to reach subscribers. A Message with a
+    conflate_key replaces an older Message with the same key which is still
+    waiting on a subscriber's queue.
+
+    """
+
+    data: Dict[str, Any]
+    payload: str
+    id: Optional[int] = None
+    frames: Dict[str, Union[str, bytes]] = field(
+        default_factory=dict, compare=False, repr=False
+    )
+    created: float = field(default_factory=time.monotonic, compare=False, repr=False)
+    conflate_key: Optional[str] = None
+
+    @property
+    def event(self) -> Optional[str]:
+        return self.data.get("event")
+
+    def encode(self, codec: Codec) -> Union[str, bytes]:
+        """
+        Get the frame for the given codec, encoding it once per Message
+
+        """
+        _frame = self.frames.get(codec.name)
+        if _frame is None:
+            _frame = self.frames[codec.name] = codec.encode(self.data)
+        return _frame
+
+    def compress(
+        self, codec: Codec, compressor: Compressor, frame: Union[str, bytes]
+    ) -> bytes:
+        """
+        Get the compressed frame for the given codec, compressing it once per Message
+
+        Parameters:
+            frame: the Message encoded with the codec
+
+        """
+        _key = f"{codec.name}+{compressor.name}"
+        _compressed = self.frames.get(_key)
+        if _compressed is None:
+            _data = frame.encode("utf-8") if isinstance(frame, str) else frame
+            _compressed = self.frames[_key] = compressor.compress(_data)
+        return _compressed  # type: ignore[return-value]
+
+    def stamp(self, id: int, codec: Codec) -> Message:
+        """
+        Return a copy of the Message carrying a sequence id in its "_id" field
+
+        For json codecs the id is spliced into the existing payload so the
+        event is not encoded again; other codecs encode the stamped data.
+
+        """
+        from .codecs import JsonCodec
+
+        _data = {"_id": id, **self.data}
+        if isinstance(codec, JsonCodec):
+            _payload = f'{{"_id": {id}, {self.payload[1:]}'
+        else:
+            _payload = codec.encode(_data)  # type: ignore[assignment]
+        return Message(
+            data=_data,
+            payload=_payload,
+            id=id,
+            created=self.created,
+            conflate_key=self.conflate_key,
+        )
+
+    @staticmethod
+    def new(
+        data: Dict[str, Any], codec: Codec, conflate_key: Optional[str] = None
+    ) -> Message:
+        return Message(
+            data=data,
+            payload=codec.encode(data),  # type: ignore[arg-type]
+            conflate_key=conflate_key,
+        )
+
+    @staticmethod
+    def decode(payload: str, codec: Codec, id: Optional[int] = None) -> Message:
+        """
+        Rebuild a Message from a payload encoded by another broker or read
+        from the event log
+
+        """
+        return Message(data=codec.decode(payload), payload=payload, id=id)
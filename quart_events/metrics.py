@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional, Tuple
+
+    from .broker import EventBroker
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram; observing a value is a bisect and two increments
+
+    """
+
+    default_buckets: Tuple[float, ...] = (
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+    )
+
+    def __init__(self, buckets: Optional[Tuple[float, ...]] = None) -> None:
+        self.buckets = buckets or self.default_buckets
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Upper bound of the bucket holding the q-th quantile
+
+        """
+        if self.count == 0:
+            return None
+
+        _rank = q * self.count
+        _seen = 0
+        for _bound, _count in zip(self.buckets, self.counts):
+            _seen += _count
+            if _seen >= _rank:
+                return _bound
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+        }
+
+
+def namespace_of(event: Any) -> str:
+    """
+    The namespace counters are kept under; the part of the event name before
+    the first ":"
+
+    """
+    if not isinstance(event, str):
+        return ""
+    return event.split(":", 1)[0]
+
+
+class BrokerMetrics:
+    """
+    Counters kept by EventBroker
+
+    Gauges such as the number of subscribers and their queue depths are read
+    from the broker when a snapshot is taken. Every update is an integer
+    increment or a histogram observation so the metrics can be left enabled
+    in production.
+
+    """
+
+    # event counts are kept for this many namespaces; events in any other
+    # namespace are counted under "_other" so clients cannot grow the labels
+    max_namespaces: int = 100
+
+    def __init__(self, broker: EventBroker) -> None:
+        self.broker = broker
+        self.started = time.monotonic()
+        self.published: int = 0
+        self.delivered: int = 0
+        self.sent: int = 0
+        self.conflated: int = 0
+        self.client_published: int = 0
+        self.publish_rejected: Counter = Counter()
+        self.connections: int = 0
+        self.events: Counter = Counter()
+        self.disconnects: Counter = Counter()
+        self.latency = Histogram()
+
+    def count_event(self, event: Any) -> None:
+        _namespace = namespace_of(event)
+        if _namespace not in self.events and len(self.events) >= self.max_namespaces:
+            _namespace = "_other"
+        self.events[_namespace] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        broker = self.broker
+        _depths = [_queue.qsize() for _queue in broker.subscribers]
+        return {
+            "uptime_seconds": time.monotonic() - self.started,
+            "subscribers": len(broker.subscribers),
+            "connections": self.connections,
+            "events_published": self.published,
+            "events_delivered": self.delivered,
+            "events_sent": self.sent,
+            "events_conflated": self.conflated,
+            "events_client_published": self.client_published,
+            "publish_rejected": dict(self.publish_rejected),
+            "events_by_namespace": dict(self.events),
+            "queue_depth": {
+                "total": sum(_depths),
+                "max": max(_depths, default=0),
+            },
+            "shard_backlog": [_shard.backlog for _shard in broker._shards],
+            "disconnects": dict(self.disconnects),
+            "overflows": dict(broker.overflow_counts),
+            "rejected": dict(broker.admission.rejected),
+            "delivery_latency_seconds": self.latency.snapshot(),
+            "tokens": broker.token_stats(),
+            "callbacks": broker.callback_stats(),
+        }
+
+    def prometheus(self) -> str:
+        """
+        The metrics in the prometheus text exposition format
+
+        """
+        broker = self.broker
+        _lines: List[str] = list()
+
+        def _metric(
+            name: str, kind: str, value: Any, labels: Optional[Dict[str, str]] = None
+        ) -> None:
+            _name = f"quart_events_{name}"
+            if not any(_line.startswith(f"# TYPE {_name} ") for _line in _lines):
+                _lines.append(f"# TYPE {_name} {kind}")
+            if labels:
+                _labels = ",".join(
+                    f'{_key}="{_escape(_value)}"' for _key, _value in labels.items()
+                )
+                _lines.append(f"{_name}{{{_labels}}} {value}")
+            else:
+                _lines.append(f"{_name} {value}")
+
+        _depths = [_queue.qsize() for _queue in broker.subscribers]
+        _metric("subscribers", "gauge", len(broker.subscribers))
+        _metric("queue_depth_total", "gauge", sum(_depths))
+        _metric("queue_depth_max", "gauge", max(_depths, default=0))
+        for _i, _shard in enumerate(broker._shards):
+            _metric("shard_backlog", "gauge", _shard.backlog, {"shard": str(_i)})
+        _metric("connections_total", "counter", self.connections)
+        _metric("events_published_total", "counter", self.published)
+        _metric("events_delivered_total", "counter", self.delivered)
+        _metric("events_sent_total", "counter", self.sent)
+        _metric("events_conflated_total", "counter", self.conflated)
+        _metric("events_client_published_total", "counter", self.client_published)
+        for _reason, _count in self.publish_rejected.items():
+            _metric("publish_rejected_total", "counter", _count, {"reason": _reason})
+        for _namespace, _count in self.events.items():
+            _metric("events_total", "counter", _count, {"namespace": _namespace})
+        for _cause, _count in self.disconnects.items():
+            _metric("disconnects_total", "counter", _count, {"cause": _cause})
+        for _policy, _count in broker.overflow_counts.items():
+            _metric("overflows_total", "counter", _count, {"policy": _policy})
+        for _reason, _count in broker.admission.rejected.items():
+            _metric("rejected_total", "counter", _count, {"reason": _reason})
+        for _key, _count in broker.token_stats().items():
+            _metric(f"tokens_{_key}", "gauge" if _key == "live" else "counter", _count)
+
+        _name = "quart_events_delivery_latency_seconds"
+        _lines.append(f"# TYPE {_name} histogram")
+        _cumulative = 0
+        for _bound, _count in zip(
+            [*map(str, self.latency.buckets), "+Inf"], self.latency.counts
+        ):
+            _cumulative += _count
+            _lines.append(f'{_name}_bucket{{le="{_bound}"}} {_cumulative}')
+        _lines.append(f"{_name}_sum {self.latency.sum}")
+        _lines.append(f"{_name}_count {self.latency.count}")
+
+        return "\n".join(_lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -15,11 +15,15 @@ import pytest_asyncio
 from asyncio_multisubscriber_queue import MultisubscriberQueue
 from typing import Dict, TYPE_CHECKING
 
+from .codecs import get_codec
+
 
 if TYPE_CHECKING:
     from _pytest.fixtures import SubRequest
     from quart.typing import TestClientProtocol
-    from typing import Any, AsyncGenerator, Iterator, List, Optional
+    from typing import Any, AsyncGenerator, Iterator, List, Optional, Union
+
+    from .codecs import Codec
 
 
 logger = logging.getLogger(__name__)
@@ -28,6 +32,7 @@ logger = logging.getLogger(__name__)
 def pytest_addoption(parser):
     parser.addini("quart_events_path", "url path for quart-events blueprint")
     parser.addini("quart_events_namespace", "optional namespace for quart-events")
+    parser.addini("quart_events_codec", "optional codec name for quart-events")
 
 
 def ignore_cancelled_error(func):
@@ -58,10 +63,12 @@ async def quart_events_catcher(
         return _val if len(_val) > 0 else default
 
     """ catch events from quart-events as they are generated in the background """
+    _codec_name = _getini("quart_events_codec", default=None)
     _catcher = EventsCatcher(
         app_test_client=app_test_client,
         blueprint_path=_getini("quart_events_path", default="/events"),
         namespace=_getini("quart_events_namespace", default=None),
+        codec=get_codec(_codec_name) if _codec_name else None,
     )
 
     async with _catcher:
@@ -71,19 +78,23 @@ async def quart_events_catcher(
 @dataclass(frozen=True)
 class Event:
     name: str = field(init=False)
-    payload: InitVar[str]
+    payload: InitVar[Union[str, bytes]]
     date: datetime = field(init=False)
     data: Dict = field(init=False)
     seconds_since_last: float = field(init=False)
     last: Event = field(repr=False)
+    codec: InitVar[Optional[Codec]] = None
 
-    def __post_init__(self, payload: str):
+    def __post_init__(self, payload: Union[str, bytes], codec: Optional[Codec]):
         object.__setattr__(self, "date", datetime.utcnow())
 
         try:
-            object.__setattr__(self, "data", json.loads(payload))
+            if codec is None:
+                object.__setattr__(self, "data", json.loads(payload))
+            else:
+                object.__setattr__(self, "data", codec.decode(payload))
         except Exception as e:
-            logger.error(f"could not decode json for event payload: {payload}")
+            logger.error(f"could not decode event payload: {payload!r}")
             raise e
 
         object.__setattr__(self, "name", self._name())
@@ -116,11 +127,13 @@ class EventsCatcher(MultisubscriberQueue):
         app_test_client: TestClientProtocol,
         blueprint_path: Optional[str],
         namespace: Optional[str] = None,
+        codec: Optional[Codec] = None,
     ):
         super().__init__()
         self.app_test_client = app_test_client
         self.blueprint_path = blueprint_path
         self.namespace = namespace
+        self.codec = codec
         self._task: Optional[asyncio.Task] = None
         self._ready: asyncio.Event = asyncio.Event()
 
@@ -157,16 +170,17 @@ class EventsCatcher(MultisubscriberQueue):
 
         logger.debug(f"subscribing to events via {self.blueprint_path}/auth")
         _last: Optional[Event] = None
-        async with self.app_test_client.websocket(url) as ws:
-            _event = await ws.receive()
-            _event = json.loads(_event)
-            assert _event.get("event") == "_open"
+        # the test client only passes subprotocols on to the app through the scope
+        _scope = {"subprotocols": [self.codec.subprotocol]} if self.codec else None
+        async with self.app_test_client.websocket(url, scope_base=_scope) as ws:
+            _event = Event(await ws.receive(), None, self.codec)
+            assert _event.name == "_open"
 
             self._ready.set()
 
             while True:
                 _data = await ws.receive()
-                _event = Event(_data, _last)
+                _event = Event(_data, _last, self.codec)
                 if _event.name == "_token_expire":
                     break
                 else:
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import fnmatch
+import functools
+import re
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, FrozenSet, Iterator, Optional, Pattern, Set
+
+    from .subscriber import SubscriberQueue
+
+
+_glob_characters = re.compile(r"[*?\[]")
+
+
+@dataclass(frozen=True)
+class Subscription:
+    """
+    The compiled form of a namespace
+
+    A namespace is a comma-separated list of patterns. A pattern without
+    glob characters, or whose only glob character is a trailing "*", is a
+    prefix of the event name. Every other pattern is a glob matched against
+    the whole event name; all of them are compiled into a single regex.
+
+    Attributes:
+        prefixes (frozenset): event name prefixes
+        pattern (re.Pattern): regex of the glob patterns, if any
+        everything (bool): the namespace matches every event
+
+    """
+
+    prefixes: FrozenSet[str] = frozenset()
+    pattern: Optional[Pattern] = None
+    everything: bool = False
+
+    @property
+    def overlapping(self) -> bool:
+        """
+        True if an event can match more than one part of the subscription
+
+        """
+        return len(self.prefixes) + (self.pattern is not None) > 1
+
+    def matches(self, event: Any) -> bool:
+        if self.everything:
+            return True
+        if not isinstance(event, str):
+            return False
+        if any(event.startswith(_prefix) for _prefix in self.prefixes):
+            return True
+        return self.pattern is not None and self.pattern.match(event) is not None
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_subscription(namespace: Optional[str] = None) -> Subscription:
+    """
+    Compile a namespace; identical namespaces share the same Subscription
+
+    """
+    _patterns = {_pattern.strip() for _pattern in (namespace or "").split(",")}
+    _patterns.discard("")
+    if not _patterns or "*" in _patterns:
+        return Subscription(everything=True)
+
+    _prefixes = set()
+    _globs = list()
+    for _pattern in sorted(_patterns):
+        if _pattern.endswith("*") and not _glob_characters.search(_pattern[:-1]):
+            _prefixes.add(_pattern[:-1])
+        elif not _glob_characters.search(_pattern):
+            _prefixes.add(_pattern)
+        else:
+            _globs.append(_pattern)
+
+    _compiled: Optional[Pattern] = None
+    if _globs:
+        _compiled = re.compile(
+            "|".join(f"(?:{fnmatch.translate(_glob)})" for _glob in _globs)
+        )
+    return Subscription(prefixes=frozenset(_prefixes), pattern=_compiled)
+
+
+class NamespaceIndex:
+    """
+    Index of subscriber queues by the namespace they are interested in
+
+    Prefixes are matched against the "event" field. Queues are bucketed by
+    their exact prefix and only the buckets whose prefix is a prefix of the
+    event name are visited, so the cost of routing an event depends on the
+    number of distinct prefix lengths rather than on the number of
+    subscribers. Queues subscribed with glob patterns are grouped by their
+    compiled pattern, which is evaluated once per event for the whole group.
+
+    """
+
+    def __init__(self) -> None:
+        self._all: Set[SubscriberQueue] = set()
+        self._prefixes: Dict[str, Set[SubscriberQueue]] = dict()
+        self._lengths: Dict[int, int] = dict()
+        self._patterns: Dict[Pattern, Set[SubscriberQueue]] = dict()
+        # queues which can be matched more than once for a single event
+        self._overlapping: int = 0
+
+    def __len__(self) -> int:
+        return (
+            len(self._all)
+            + sum(len(_q) for _q in self._prefixes.values())
+            + sum(len(_q) for _q in self._patterns.values())
+        )
+
+    def add(self, queue: SubscriberQueue, namespace: Optional[str] = None) -> None:
+        """
+        Add a queue to the index; a queue without a namespace receives every event
+
+        """
+        _subscription = parse_subscription(namespace)
+        if _subscription.everything:
+            self._all.add(queue)
+            return
+
+        for _prefix in _subscription.prefixes:
+            if _prefix not in self._prefixes:
+                self._prefixes[_prefix] = set()
+                _length = len(_prefix)
+                self._lengths[_length] = self._lengths.get(_length, 0) + 1
+            self._prefixes[_prefix].add(queue)
+
+        if _subscription.pattern is not None:
+            self._patterns.setdefault(_subscription.pattern, set()).add(queue)
+
+        if _subscription.overlapping:
+            self._overlapping += 1
+
+    def remove(self, queue: SubscriberQueue, namespace: Optional[str] = None) -> None:
+        _subscription = parse_subscription(namespace)
+        if _subscription.everything:
+            self._all.discard(queue)
+            return
+
+        _removed = False
+        for _prefix in _subscription.prefixes:
+            _bucket = self._prefixes.get(_prefix)
+            if _bucket is None or queue not in _bucket:
+                continue
+
+            _removed = True
+            _bucket.discard(queue)
+            if not _bucket:
+                del self._prefixes[_prefix]
+                _length = len(_prefix)
+                self._lengths[_length] -= 1
+                if self._lengths[_length] == 0:
+                    del self._lengths[_length]
+
+        if _subscription.pattern is not None:
+            _bucket = self._patterns.get(_subscription.pattern)
+            if _bucket is not None and queue in _bucket:
+                _removed = True
+                _bucket.discard(queue)
+                if not _bucket:
+                    del self._patterns[_subscription.pattern]
+
+        if _removed and _subscription.overlapping:
+            self._overlapping -= 1
+
+    def match(self, event: Optional[str]) -> Iterator[SubscriberQueue]:
+        """
+        Yield every queue whose namespace matches the given event name
+
+        Each queue is yielded once even if several of its patterns match.
+
+        """
+        if not self._overlapping:
+            yield from self._match(event)
+            return
+
+        _seen: Set[SubscriberQueue] = set()
+        for _queue in self._match(event):
+            if _queue not in _seen:
+                _seen.add(_queue)
+                yield _queue
+
+    def _match(self, event: Optional[str]) -> Iterator[SubscriberQueue]:
+        yield from self._all
+
+        if not isinstance(event, str):
+            return
+
+        _event_length = len(event)
+        for _length in self._lengths:
+            if _length <= _event_length:
+                _bucket = self._prefixes.get(event[:_length])
+                if _bucket:
+                    yield from _bucket
+
+        for _pattern, _bucket in self._patterns.items():
+            if _pattern.match(event):
+                yield from _bucket
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from .routing import NamespaceIndex
+
+
+if TYPE_CHECKING:
+    from typing import List, Optional, Union
+
+    from .broker import EventBroker
+    from .message import Message
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryShard:
+    """
+    A group of subscribers whose queues are filled by their own task
+
+    The broker only puts each Message on the shard's inbox; the shard's
+    task then routes it through the shard's NamespaceIndex and puts it on
+    the matching subscriber queues. Events are handled in order, so every
+    subscriber still receives them in the order they were put.
+
+    """
+
+    def __init__(self, broker: EventBroker) -> None:
+        self.broker = broker
+        self.index = NamespaceIndex()
+        self.subscribers: int = 0
+        # created by start(); on python < 3.10 a queue binds to the loop
+        # current when it is created, which may not be the app's loop yet
+        self.inbox: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def backlog(self) -> int:
+        return self.inbox.qsize() if self.inbox is not None else 0
+
+    def start(self) -> None:
+        if self.inbox is None:
+            self.inbox = asyncio.Queue()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(self.inbox))
+
+    def put_nowait(self, item: Union[Message, List[Message]]) -> None:
+        if self.inbox is None:
+            raise RuntimeError("the shard has not been started")
+        self.inbox.put_nowait(item)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.inbox = None
+
+    async def _run(self, inbox: asyncio.Queue) -> None:
+        _loop = asyncio.get_running_loop()
+        while True:
+            _item: Union[Message, List[Message]] = await inbox.get()
+            try:
+                if isinstance(_item, list):
+                    await self.broker._fan_out_many(self.index, _item, _loop.time())
+                else:
+                    await self.broker._fan_out(self.index, _item, _loop.time())
+            except Exception as e:
+                logger.exception(e)
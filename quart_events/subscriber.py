@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+from enum import Enum
+from typing import TYPE_CHECKING
+
+from .message import Message
+
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, Optional
+
+    from .routing import NamespaceIndex
+
+
+class OverflowPolicy(str, Enum):
+    """
+    What EventBroker does when a bounded subscriber queue is full
+
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    DISCONNECT = "disconnect"
+    BLOCK = "block"
+
+
+class _Conflated:
+    """
+    Queue entry holding the latest Message for a conflate key
+
+    """
+
+    __slots__ = ("key", "message")
+
+    def __init__(self, key: str, message: Message) -> None:
+        self.key = key
+        self.message = message
+
+
+class SubscriberQueue(asyncio.Queue):
+    """
+    asyncio.Queue with the bookkeeping EventBroker needs for each subscriber
+
+    Attributes:
+        namespace (str): namespace the subscriber is filtered on; see
+            quart_events.routing.parse_subscription()
+        last_active (float): loop time of the last item put on the queue;
+            used by the broker's keepalive task to find idle subscribers
+        index (quart_events.routing.NamespaceIndex): index the queue is
+            registered in
+        replayed_id (int): id of the last event sent from the replay buffer
+        overflows (int): number of events which found the queue full
+        conflated (int): number of events which replaced a pending event
+            with the same conflate key
+
+    Messages with a conflate key are held in a slot on the queue; while
+    the slot is waiting a newer Message with the same key replaces it in
+    place instead of being appended, so slow subscribers skip stale values.
+
+    The size of the queue is counted in events: a list of Messages put by
+    put_many() counts as its length, so maxsize bounds the events waiting
+    rather than the queue operations.
+
+    """
+
+    def __init__(self, namespace: Optional[str] = None, **kwargs: Any) -> None:
+        self._events: int = 0
+        super().__init__(**kwargs)
+        self.namespace = namespace
+        self.last_active: float = asyncio.get_running_loop().time()
+        self.index: NamespaceIndex
+        self.replayed_id: int = 0
+        self.overflows: int = 0
+        self.conflated: int = 0
+        self._conflated: Dict[str, _Conflated] = dict()
+
+    def conflate(self, message: Message) -> bool:
+        """
+        Replace the waiting Message with the same conflate key
+
+        Returns:
+            False if no Message with the key is waiting and the Message
+            must be put on the queue
+
+        """
+        _slot = self._conflated.get(message.conflate_key)  # type: ignore[arg-type]
+        if _slot is None:
+            return False
+        _slot.message = message
+        self.conflated += 1
+        return True
+
+    def qsize(self) -> int:
+        return self._events
+
+    def _put(self, item: Any) -> None:
+        self._events += len(item) if type(item) is list else 1
+        if type(item) is Message and item.conflate_key is not None:
+            _slot = _Conflated(item.conflate_key, item)
+            self._conflated[_slot.key] = _slot
+            item = _slot
+        super()._put(item)
+
+    def _get(self) -> Any:
+        _item = super()._get()
+        self._events -= len(_item) if type(_item) is list else 1
+        if type(_item) is _Conflated:
+            if self._conflated.get(_item.key) is _item:
+                del self._conflated[_item.key]
+            return _item.message
+        return _item
+
+    def drain(self) -> None:
+        """
+        Discard everything waiting on the queue
+
+        """
+        while not self.empty():
+            self.get_nowait()
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+from uuid import UUID, uuid4
+
+from itsdangerous import BadSignature, TimestampSigner
+
+
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional, Tuple, Union
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Token:
+    value: UUID
+    date: datetime
+
+    def __str__(self):
+        return str(self.value)
+
+    @staticmethod
+    def new():
+        return Token(value=uuid4(), date=datetime.utcnow())
+
+
+class NullToken(Token):
+    def __init__(self):
+        super().__init__(value=None, date=None)
+
+    def __bool__(self) -> bool:
+        return False
+
+
+class TokenSigner:
+    """
+    Sign tokens so they can be verified without any server-side state
+
+    The token value is signed with an HMAC of the app's SECRET_KEY along with
+    the time it was issued. Verification is a constant-time signature check
+    plus an age check, so any worker sharing the SECRET_KEY can verify a
+    token issued by another worker or before a restart.
+
+    Parameters:
+        secret_key (str): the app's SECRET_KEY
+        expire_seconds (int): maximum age of a token
+
+    """
+
+    salt = "quart-events-token"
+
+    def __init__(self, secret_key: Union[str, bytes], expire_seconds: int) -> None:
+        self.expire_seconds = expire_seconds
+        self._signer = TimestampSigner(secret_key, salt=self.salt)
+
+    def sign(self, token: Token) -> str:
+        return self._signer.sign(str(token.value)).decode("ascii")
+
+    def unsign(self, value: str) -> Token:
+        """
+        Verify a signed token
+
+        Returns:
+            the Token or NullToken if the signature is invalid or expired
+
+        """
+        try:
+            _value, _date = self._signer.unsign(
+                value, max_age=self.expire_seconds, return_timestamp=True
+            )
+        except (BadSignature, TypeError):
+            return NullToken()
+
+        # tokens use naive utc datetimes
+        return Token(
+            value=UUID(_value.decode("ascii")), date=_date.replace(tzinfo=None)
+        )
+
+
+class TokenStore:
+    """
+    Issued tokens ordered by expiration
+
+    Tokens are kept in a dict for lookups and in a heap ordered by their
+    expiration, so pruning only visits tokens which have actually expired.
+    A background task prunes the store while it holds tokens.
+
+    Parameters:
+        expire_seconds (int): lifetime of a token
+        max_size (int): maximum number of live tokens; the tokens closest to
+            expiring are evicted to make room; None means unbounded
+        prune_interval (float): seconds between background prunes
+        prune_batch (int): maximum number of tokens removed before yielding
+            to the event loop
+
+    """
+
+    def __init__(
+        self,
+        expire_seconds: int,
+        max_size: Optional[int] = None,
+        prune_interval: float = 60.0,
+        prune_batch: int = 1000,
+    ) -> None:
+        self.expire_seconds = expire_seconds
+        self.max_size = max_size
+        self.prune_interval = prune_interval
+        self.prune_batch = prune_batch
+        self.issued: int = 0
+        self.expired: int = 0
+        self.evicted: int = 0
+        self._tokens: Dict[str, Token] = dict()
+        self._heap: List[Tuple[datetime, str]] = list()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._tokens
+
+    def get(self, key: str) -> Optional[Token]:
+        return self._tokens.get(key)
+
+    def is_expired(self, token: Token, now: Optional[datetime] = None) -> bool:
+        if type(token) is NullToken:
+            return True
+
+        _now = now or datetime.utcnow()
+        return token.date < _now - timedelta(seconds=self.expire_seconds)
+
+    def add(self, token: Token) -> None:
+        _key = str(token.value)
+        self._tokens[_key] = token
+        heapq.heappush(self._heap, (token.date, _key))
+        self.issued += 1
+
+        if self.max_size is not None:
+            while len(self._tokens) > self.max_size:
+                _, _evicted = heapq.heappop(self._heap)
+                if self._tokens.pop(_evicted, None) is not None:
+                    self.evicted += 1
+
+        self._start()
+
+    def discard(self, key: str) -> None:
+        # the heap entry is skipped when it is popped
+        self._tokens.pop(key, None)
+
+    def prune(self, limit: Optional[int] = None) -> int:
+        """
+        Remove expired tokens
+
+        Parameters:
+            limit (int): stop after this many tokens have been removed
+
+        Returns:
+            number of heap entries removed
+
+        """
+        _oldest = datetime.utcnow() - timedelta(seconds=self.expire_seconds)
+        _count = 0
+        while self._heap and self._heap[0][0] < _oldest:
+            if limit is not None and _count >= limit:
+                break
+            _, _key = heapq.heappop(self._heap)
+            _token = self._tokens.get(_key)
+            if _token is not None and _token.date < _oldest:
+                del self._tokens[_key]
+                self.expired += 1
+            _count += 1
+        return _count
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "live": len(self._tokens),
+            "issued": self.issued,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def _start(self) -> None:
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                # no running loop; tokens are pruned on the next add()
+                pass
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while self._tokens:
+            await asyncio.sleep(self.prune_interval)
+            while self.prune(limit=self.prune_batch) >= self.prune_batch:
+                await asyncio.sleep(0)
@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import pytest
+from quart import Quart
+
+from quart_events import EventBroker
+from quart_events.admission import AdmissionController
+
+
+def test_subscriber_caps():
+    admission = AdmissionController(max_subscribers=3, max_subscribers_per_key=2)
+    for _key in ("a", "a", "b"):
+        assert admission.admit(_key) is None
+        admission.acquire(_key)
+
+    assert admission.admit("a") == "too many subscribers"
+    admission.release("b")
+    assert admission.admit("a") == "too many subscribers for this session"
+    assert admission.admit("b") is None
+    admission.release("a")
+    assert admission.admit("a") is None
+    assert admission.rejected == {
+        "too many subscribers": 1,
+        "too many subscribers for this session": 1,
+    }
+
+
+def test_connect_rate(monkeypatch):
+    _now = [1000.0]
+    monkeypatch.setattr("quart_events.admission.time.monotonic", lambda: _now[0])
+    admission = AdmissionController(connect_rate=2, connect_burst=3)
+
+    assert [admission.admit("a") for _ in range(4)] == [None] * 3 + [
+        "connect rate exceeded"
+    ]
+    assert admission.admit("b") is None
+
+    _now[0] += 0.5
+    assert admission.admit("a") is None
+    assert admission.admit("a") == "connect rate exceeded"
+
+    admission.max_tracked = 1
+    _now[0] += 10
+    admission.admit("c")
+    assert list(admission._buckets) == ["c"]
+
+
+@pytest.mark.asyncio
+async def test_websocket_rejected():
+    app = Quart(__name__)
+    app.config["SECRET_KEY"] = b"00000000000000000000000000000000"
+    broker = EventBroker(app, max_subscribers_per_session=1)
+    _verified = list()
+
+    @broker.verify
+    def verify():
+        _verified.append(True)
+
+    client = app.test_client()
+    r = await client.get("/events/auth")
+    assert r.status_code == 200
+
+    async with client.websocket("/events/ws") as ws:
+        assert json.loads(await ws.receive()) == {"event": "_open"}
+
+        async with client.websocket("/events/ws") as ws_rejected:
+            assert json.loads(await ws_rejected.receive()) == {
+                "event": "_rejected",
+                "message": "too many subscribers for this session",
+            }
+
+    assert _verified == [True]
+    assert broker.metrics.snapshot()["rejected"] == {
+        "too many subscribers for this session": 1
+    }
+
+    while broker.admission.active:
+        await asyncio.sleep(0.01)
+    async with client.websocket("/events/ws") as ws:
+        assert json.loads(await ws.receive()) == {"event": "_open"}
+
+    await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_sse_rejected():
+    app = Quart(__name__)
+    app.config["SECRET_KEY"] = b"00000000000000000000000000000000"
+    broker = EventBroker(app, max_subscribers=1)
+
+    @broker.verify
+    async def verify():
+        await asyncio.sleep(0.05)
+
+    client = app.test_client()
+    r = await client.get("/events/auth")
+    assert r.status_code == 200
+
+    _frames = list()
+
+    async def _connect():
+        async with client.request("/events/sse") as connection:
+            await connection.send_complete()
+            _frames.append(await connection.receive())
+            while len(_frames) < 5:
+                await asyncio.sleep(0.01)
+            await connection.disconnect()
+
+    await asyncio.gather(*[_connect() for _ in range(5)])
+    assert _frames.count(b'data: {"event": "_open"}\n\n') == 1
+    assert broker.admission.rejected == {"too many subscribers": 4}
+
+    while broker.admission.active:
+        await asyncio.sleep(0.01)
+    await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_sse_released_without_iteration():
+    app = Quart(__name__)
+    broker = EventBroker(app, auth=False)
+
+    async with app.test_request_context("/events/sse"):
+        r = await app.view_functions["events.sse"]()
+        assert broker.admission.active == 1
+        del r
+    assert broker.admission.active == 0
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pytest
+from quart import Quart
+
+from quart_events import EventBroker
+from quart_events.backends import UnixSocketBackend
+from quart_events.hub import Hub, pack_frame
+
+
+@pytest.mark.asyncio
+async def test_unix_socket_backend(tmp_path):
+    _path = str(tmp_path / "hub.sock")
+    async with Hub(_path):
+        _brokers = [
+            EventBroker(Quart(__name__), auth=False, backend=UnixSocketBackend(_path))
+            for _ in range(3)
+        ]
+        for _broker in _brokers:
+            await _broker.start()
+
+        try:
+            with _brokers[0].queue() as q0, _brokers[1].queue() as q1, _brokers[
+                2
+            ].queue("ns1") as q2:
+                await _brokers[0].put(event="ns0:test", data="value")
+                _message0 = q0.get_nowait()
+                _message1 = await asyncio.wait_for(q1.get(), 1)
+
+                assert _message1.payload == _message0.payload
+                assert _message1.data == {"event": "ns0:test", "data": "value"}
+
+                await asyncio.sleep(0.1)
+                assert q0.empty()
+                assert q2.empty()
+        finally:
+            for _broker in _brokers:
+                await _broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_unix_socket_backend_malformed_frame(tmp_path):
+    _path = str(tmp_path / "hub.sock")
+    async with Hub(_path):
+        broker = EventBroker(
+            Quart(__name__), auth=False, backend=UnixSocketBackend(_path)
+        )
+        await broker.start()
+        _reader, _writer = await asyncio.open_unix_connection(_path)
+
+        try:
+            with broker.queue() as q:
+                _writer.write(pack_frame(b"not json"))
+                _writer.write(pack_frame(json.dumps({"event": "test"}).encode()))
+                await _writer.drain()
+
+                _message = await asyncio.wait_for(q.get(), 1)
+                assert _message.data == {"event": "test"}
+                assert broker.backend._writer is not None
+        finally:
+            _writer.close()
+            await broker.stop()
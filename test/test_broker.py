@@ -0,0 +1,497 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from quart import Quart
+
+from quart_events import EventBroker, EventBrokerError
+from quart_events.broker import (
+    KeepAlive,
+    Message,
+    Overflow,
+    Resync,
+    Shutdown,
+    TokenExpired,
+)
+from quart_events.codecs import JsonCodec, MsgpackCodec
+
+
+@pytest.fixture
+def broker() -> EventBroker:
+    return EventBroker(Quart(__name__), auth=False)
+
+
+@pytest.mark.asyncio
+async def test_put_encodes_once(broker):
+    with broker.queue() as q1, broker.queue() as q2:
+        await broker.put(event="test", data="value")
+        _message1 = q1.get_nowait()
+        _message2 = q2.get_nowait()
+
+    assert isinstance(_message1, Message)
+    assert _message1 is _message2
+    assert _message1.event == "test"
+    assert json.loads(_message1.payload) == {"event": "test", "data": "value"}
+
+
+@pytest.mark.asyncio
+async def test_put_routes_by_namespace(broker):
+    with broker.queue() as q_all, broker.queue("ns0") as q_ns0, broker.queue(
+        "ns1:test"
+    ) as q_ns1:
+        await broker.put(event="ns0:test0")
+        await broker.put(event="ns1:test1")
+        await broker.put(event="ns1:other")
+        await broker.put(data="no event")
+
+        assert q_all.qsize() == 4
+        assert q_ns0.get_nowait().event == "ns0:test0"
+        assert q_ns0.empty()
+        assert q_ns1.get_nowait().event == "ns1:test1"
+        assert q_ns1.empty()
+
+
+@pytest.mark.asyncio
+async def test_put_without_matching_subscriber(broker, monkeypatch):
+    def _fail(data):
+        raise AssertionError("event should not be encoded")
+
+    monkeypatch.setattr(Message, "new", _fail)
+    with broker.queue("ns0") as q:
+        await broker.put(event="ns1:test")
+        assert q.empty()
+
+
+@pytest.mark.asyncio
+async def test_shared_keepalive():
+    broker = EventBroker(Quart(__name__), auth=False, keepalive=1)
+    with broker.queue("ns1") as q_idle, broker.queue() as q_busy:
+        _task = broker._keepalive_task
+        assert _task is not None
+
+        for _ in range(4):
+            await asyncio.sleep(0.3)
+            await broker.put(event="ns0:test")
+
+        assert broker._keepalive_task is _task
+        assert [q_idle.get_nowait() for _ in range(q_idle.qsize())].count(
+            KeepAlive
+        ) == 1
+        assert all(q_busy.get_nowait() is not KeepAlive for _ in range(4))
+
+    # a subscriber joining before the cancelled task has exited gets a new one
+    with broker.queue() as q:
+        assert broker._keepalive_task is not _task
+        assert await asyncio.wait_for(q.get(), 2) is KeepAlive
+
+    await asyncio.sleep(0)
+    assert _task.done()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "policy,expected",
+    [
+        ("drop_oldest", ["test1", "test2"]),
+        ("drop_newest", ["test0", "test1"]),
+        ("disconnect", [Overflow]),
+        ("block", ["test0", "test1"]),
+    ],
+)
+async def test_overflow_policy(policy, expected):
+    broker = EventBroker(
+        Quart(__name__),
+        auth=False,
+        max_queue_size=2,
+        overflow_policy=policy,
+        overflow_timeout=0.1,
+    )
+    with broker.queue() as q:
+        await broker.put(event="test0")
+        await broker.put(event="test1")
+        await broker.put(event="test2")
+
+        assert q.overflows == 1
+        assert broker.overflow_counts[policy] == 1
+        _values = [q.get_nowait() for _ in range(q.qsize())]
+        assert [
+            _value if _value is Overflow else _value.event for _value in _values
+        ] == expected
+
+    if policy == "block":
+        assert broker.overflow_counts["block_timeout"] == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "policy,expected",
+    [
+        ("drop_oldest", [("test2", 998), ("test2", 999)]),
+        ("drop_newest", [("test0", 0), ("test0", 1)]),
+        ("disconnect", [Overflow]),
+        ("block", [("test0", 0), ("test0", 1)]),
+    ],
+)
+async def test_overflow_policy_many(policy, expected):
+    broker = EventBroker(
+        Quart(__name__),
+        auth=False,
+        max_queue_size=2,
+        overflow_policy=policy,
+        overflow_timeout=0.05,
+    )
+    with broker.queue() as q:
+        for i in range(3):
+            await broker.put_many(
+                [{"event": f"test{i}", "data": j} for j in range(1000)]
+            )
+
+        # the queue is bounded in events, not in put_many() calls
+        assert q.qsize() <= 2
+        # a disconnected subscriber receives no more events
+        assert q.overflows == (998 if policy == "disconnect" else 2998)
+        _values = list()
+        while not q.empty():
+            _value = q.get_nowait()
+            _values.extend(_value if isinstance(_value, list) else [_value])
+        assert [
+            _value if _value is Overflow else (_value.event, _value.data["data"])
+            for _value in _values
+        ] == expected
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch(broker):
+    _batches = list()
+
+    async def _subscriber():
+        async for _batch in broker.subscribe(batch=True):
+            _batches.append(_batch)
+            if _batch is KeepAlive:
+                break
+
+    _task = asyncio.create_task(_subscriber())
+    while not broker.subscribers:
+        await asyncio.sleep(0)
+    for i in range(3):
+        await broker.put(event=f"test{i}")
+    await asyncio.sleep(0.05)
+    await broker.put(event="test3")
+    await asyncio.sleep(0.05)
+    broker.subscribers[0].put_nowait(KeepAlive)
+    await asyncio.wait_for(_task, 1)
+
+    assert [[_m.event for _m in _batch] for _batch in _batches[:2]] == [
+        ["test0", "test1", "test2"],
+        ["test3"],
+    ]
+    assert _batches[2] is KeepAlive
+
+
+@pytest.mark.asyncio
+async def test_replay():
+    broker = EventBroker(Quart(__name__), auth=False, replay_size=3)
+    for i in range(5):
+        await broker.put(event=f"ns{i % 2}:test{i}")
+
+    _messages = broker.replay(3)
+    assert [_message.id for _message in _messages] == [4, 5]
+    assert json.loads(_messages[0].payload) == {"_id": 4, "event": "ns1:test3"}
+    assert [_message.event for _message in broker.replay(2, "ns0")] == [
+        "ns0:test2",
+        "ns0:test4",
+    ]
+    assert broker.replay(5) == []
+    assert broker.replay(1) is None
+    assert broker.replay(6) is None
+
+    _values = list()
+
+    async def _subscriber(since):
+        async for _value in broker.subscribe(since=since):
+            _values.append(_value)
+            if len(_values) == 3:
+                break
+
+    _task = asyncio.create_task(_subscriber(3))
+    while not broker.subscribers:
+        await asyncio.sleep(0)
+    await broker.put(event="test5")
+    await asyncio.wait_for(_task, 1)
+    assert [_value.id for _value in _values] == [4, 5, 6]
+
+    _values.clear()
+    _task = asyncio.create_task(_subscriber(0))
+    while not broker.subscribers:
+        await asyncio.sleep(0)
+    await broker.put(event="test6")
+    await broker.put(event="test7")
+    await asyncio.wait_for(_task, 1)
+    assert _values[0] is Resync
+    assert [_value.id for _value in _values[1:]] == [7, 8]
+
+
+@pytest.mark.asyncio
+async def test_queue_expires(broker):
+    _expires = asyncio.get_running_loop().time() + 0.05
+    with broker.queue(expires=_expires) as q:
+        await broker.put(event="test0")
+        assert q.qsize() == 1
+
+        assert await asyncio.wait_for(q.get(), 1) is not TokenExpired
+        assert await asyncio.wait_for(q.get(), 1) is TokenExpired
+
+        await broker.put(event="test1")
+        assert q.empty()
+
+
+@pytest.mark.asyncio
+async def test_put_many(broker):
+    _events = [{"event": "ns0:test0"}, {"event": "ns1:test1"}, {"data": "no event"}]
+    with broker.queue() as q_all, broker.queue("ns1") as q_ns1, broker.queue(
+        "ns2"
+    ) as q_ns2:
+        await broker.put_many(_events)
+
+        # one queue operation; the queue's size is counted in events
+        assert q_all.qsize() == 3
+        assert [_m.event for _m in q_all.get_nowait()] == ["ns0:test0", "ns1:test1", None]
+        assert q_all.empty()
+        assert [_m.event for _m in q_ns1.get_nowait()] == ["ns1:test1"]
+        assert q_ns2.empty()
+
+    assert _events[2] == {"data": "no event"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("batch", [False, True])
+async def test_subscribe_put_many(broker, batch):
+    _values = list()
+
+    async def _subscriber():
+        async for _value in broker.subscribe(batch=batch):
+            _values.append(_value)
+            if _value is KeepAlive:
+                break
+
+    _task = asyncio.create_task(_subscriber())
+    while not broker.subscribers:
+        await asyncio.sleep(0)
+    await broker.put_many([{"event": f"test{i}"} for i in range(3)])
+    await asyncio.sleep(0.05)
+    broker.subscribers[0].put_nowait(KeepAlive)
+    await asyncio.wait_for(_task, 1)
+
+    if batch:
+        assert [_m.event for _m in _values[0]] == ["test0", "test1", "test2"]
+    else:
+        assert [_m.event for _m in _values[:3]] == ["test0", "test1", "test2"]
+
+
+@pytest.mark.asyncio
+async def test_reserved_id(broker):
+    # "_id" is only reserved when the broker stamps event ids
+    with broker.queue() as q:
+        await broker.put(event="test", _id="user-id")
+        assert q.get_nowait().data == {"event": "test", "_id": "user-id"}
+
+    broker = EventBroker(Quart(__name__), auth=False, replay_size=10)
+    with pytest.raises(EventBrokerError):
+        await broker.put(event="test", _id="user-id")
+    with pytest.raises(EventBrokerError):
+        await broker.put_many([{"event": "test"}, {"event": "test", "_id": 1}])
+    assert await broker._publish_from_client({"event": "test", "_id": 1}) == (
+        "reserved event name"
+    )
+    assert broker.metrics.published == 0
+
+
+def test_stamp_codecs():
+    _message = Message.new({"event": "test"}, JsonCodec()).stamp(1, JsonCodec())
+    assert json.loads(_message.payload) == {"_id": 1, "event": "test"}
+
+    pytest.importorskip("msgpack")
+    codec = MsgpackCodec()
+    _message = Message.new({"event": "test"}, codec).stamp(1, codec)
+    assert codec.decode(_message.payload) == {"_id": 1, "event": "test"}
+
+
+@pytest.mark.asyncio
+async def test_put_threadsafe(broker, monkeypatch):
+    with pytest.raises(EventBrokerError):
+        broker.put_threadsafe(event="test")
+
+    await broker.start()
+    _loop = asyncio.get_running_loop()
+    _wakeups = list()
+    _call_soon_threadsafe = _loop.call_soon_threadsafe
+
+    def _count_wakeups(*args):
+        _wakeups.append(args)
+        return _call_soon_threadsafe(*args)
+
+    monkeypatch.setattr(_loop, "call_soon_threadsafe", _count_wakeups)
+
+    def _producer(n):
+        for i in range(100):
+            broker.put_threadsafe(event=f"thread{n}", data=i)
+
+    with broker.queue() as q:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            await asyncio.gather(
+                *[_loop.run_in_executor(executor, _producer, n) for n in range(4)]
+            )
+        while broker._drain_tasks or broker._drain_scheduled:
+            await asyncio.sleep(0.01)
+
+        _messages = list()
+        while not q.empty():
+            _messages.extend(q.get_nowait())
+
+    assert len(_messages) == 400
+    assert len(_wakeups) < 400
+    for n in range(4):
+        assert [
+            _message.data["data"]
+            for _message in _messages
+            if _message.event == f"thread{n}"
+        ] == list(range(100))
+
+
+@pytest.mark.asyncio
+async def test_subscribe_multiple_patterns():
+    broker = EventBroker(Quart(__name__), auth=False, replay_size=10)
+    await broker.put(event="orders:created")
+    await broker.put(event="inventory:high_stock")
+    await broker.put(event="inventory:low_stock")
+
+    assert [
+        _message.event for _message in broker.replay(0, "orders:*,inventory:low_*")
+    ] == ["orders:created", "inventory:low_stock"]
+
+    with broker.queue("orders:*,inventory:low_*,orders:c*") as q:
+        await broker.put(event="orders:created")
+        await broker.put(event="inventory:high_stock")
+        await broker.put(event="inventory:low_stock")
+
+        assert q.get_nowait().event == "orders:created"
+        assert q.get_nowait().event == "inventory:low_stock"
+        assert q.empty()
+
+
+@pytest.mark.asyncio
+async def test_put_conflate_key():
+    broker = EventBroker(Quart(__name__), auth=False, max_queue_size=3)
+    with broker.queue() as q:
+        for _price in range(5):
+            await broker.put(event="price", price=_price, conflate_key="AAA")
+            await broker.put(event="price", price=_price, conflate_key="BBB")
+        await broker.put(event="status")
+        # the queue is full but a waiting key is still replaced
+        await broker.put(event="price", price=5, conflate_key="AAA")
+
+        assert q.qsize() == 3
+        assert q.get_nowait().data == {"event": "price", "price": 5}
+        assert q.get_nowait().data == {"event": "price", "price": 4}
+        assert q.get_nowait().event == "status"
+
+        # once sent, the next event with the key is queued again
+        await broker.put(event="price", price=6, conflate_key="AAA")
+        await broker.put(event="price", price=7, conflate_key="AAA")
+        assert q.qsize() == 1
+        assert q.get_nowait().data == {"event": "price", "price": 7}
+
+    assert q.conflated == 10
+    assert broker.overflow_counts == {}
+    assert broker.metrics.snapshot()["events_conflated"] == 10
+
+
+@pytest.mark.asyncio
+async def test_shutdown(broker):
+    _received = list()
+    _release = asyncio.Event()
+
+    async def _subscriber(slow):
+        async for _message in broker.subscribe():
+            if slow:
+                await _release.wait()
+            _received.append((slow, _message))
+            if _message is Shutdown:
+                break
+
+    _tasks = [asyncio.create_task(_subscriber(_slow)) for _slow in (False, True)]
+    while len(broker.subscribers) < 2:
+        await asyncio.sleep(0)
+    for i in range(3):
+        await broker.put(event=f"test{i}")
+
+    # the fast subscriber receives its pending events; the slow one times out
+    await broker.shutdown(timeout=0.1)
+    _release.set()
+    await asyncio.wait_for(asyncio.gather(*_tasks), 1)
+
+    _fast = [_message for _slow, _message in _received if not _slow]
+    assert [_message.event for _message in _fast[:-1]] == ["test0", "test1", "test2"]
+    assert _fast[-1] is Shutdown
+    _slow = [_message for _slow, _message in _received if _slow]
+    assert _slow[0].event == "test0"
+    assert _slow[-1] is Shutdown
+    assert len(_slow) < 4
+
+    assert broker.admission.admit("key") == "shutting down"
+
+
+@pytest.mark.asyncio
+async def test_sharded_delivery():
+    broker = EventBroker(Quart(__name__), auth=False, shards=3, replay_size=10)
+    with broker.queue() as q0, broker.queue("ns0") as q1, broker.queue() as q2:
+        assert [_shard.subscribers for _shard in broker._shards] == [1, 1, 1]
+
+        await broker.put(event="ns0:test0")
+        await broker.put_many([{"event": "ns1:test1"}, {"event": "ns0:test2"}])
+        while any(_shard.backlog for _shard in broker._shards):
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        for _queue in (q0, q2):
+            assert _queue.get_nowait().event == "ns0:test0"
+            assert [_m.event for _m in _queue.get_nowait()] == [
+                "ns1:test1",
+                "ns0:test2",
+            ]
+        assert q1.get_nowait().event == "ns0:test0"
+        assert [_m.event for _m in q1.get_nowait()] == ["ns0:test2"]
+
+    # events waiting in a shard are not sent again after being replayed
+    _messages = list()
+
+    async def _subscriber():
+        async for _message in broker.subscribe(since=0):
+            _messages.append(_message)
+            if _message.event == "test4":
+                break
+
+    _task = asyncio.create_task(_subscriber())
+    # the subscriber runs before the shards' tasks
+    _message = broker._stamp(Message.new({"event": "test3"}, broker.codec), 0)
+    for _shard in broker._shards:
+        _shard.inbox.put_nowait(_message)
+    await asyncio.sleep(0.01)
+    await broker.put(event="test4")
+    await asyncio.wait_for(_task, 1)
+
+    assert [_message.id for _message in _messages] == [1, 2, 3, 4, 5]
+    await broker.stop()
+
+
+def test_shards_created_outside_loop():
+    broker = EventBroker(Quart(__name__), auth=False, shards=2)
+
+    async def _main():
+        with broker.queue() as q:
+            await broker.put(event="test")
+            assert (await asyncio.wait_for(q.get(), 1)).event == "test"
+        await broker.stop()
+
+    asyncio.run(_main())
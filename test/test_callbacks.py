@@ -0,0 +1,74 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from quart import Quart
+
+from quart_events import EventBroker
+from quart_events.callbacks import CallbackPipeline
+
+
+@pytest.mark.asyncio
+async def test_pipeline():
+    _calls = list()
+    pipeline = CallbackPipeline()
+
+    @pipeline.add
+    def sync_callback(value):
+        _calls.append(("sync", value))
+
+    @pipeline.add
+    async def async_callback(value):
+        _calls.append(("async", value))
+
+    assert len(pipeline) == 2
+    await pipeline(1)
+    await pipeline(2)
+
+    assert _calls == [("sync", 1), ("async", 1), ("sync", 2), ("async", 2)]
+    _stats = pipeline.stats()
+    assert _stats["test_pipeline.<locals>.sync_callback"]["calls"] == 2
+    assert _stats["test_pipeline.<locals>.async_callback"]["errors"] == 0
+
+
+@pytest.mark.asyncio
+async def test_pipeline_executor():
+    _threads = list()
+
+    def _callback():
+        _threads.append(threading.get_ident())
+        raise ValueError()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pipeline = CallbackPipeline(executor)
+        pipeline.add(_callback)
+        with pytest.raises(ValueError):
+            await pipeline()
+
+    assert _threads[0] != threading.get_ident()
+    assert list(pipeline.stats().values())[0]["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_broker_executor_after_stop():
+    app = Quart(__name__)
+    broker = EventBroker(app, auth=False, callback_executor=1)
+    _threads = list()
+
+    @broker.send
+    def send_callback(data):
+        _threads.append(threading.current_thread().name)
+
+    for _ in range(2):
+        async with app.test_app() as test_app:
+            async with test_app.test_client().websocket("/events/ws") as ws:
+                assert json.loads(await ws.receive()) == {"event": "_open"}
+                while not broker.subscribers:
+                    await asyncio.sleep(0.01)
+                await broker.put(event="test")
+                assert json.loads(await ws.receive()) == {"event": "test"}
+
+    assert len(_threads) == 2
+    assert all(_name.startswith("quart-events") for _name in _threads)
@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+import pytest
+from quart import Quart
+
+from quart_events import EventBroker
+from quart_events.broker import Message
+from quart_events.codecs import JsonCodec, MsgpackCodec, OrjsonCodec, get_codec
+from quart_events.pytest_plugin import EventsCatcher
+
+
+@pytest.mark.parametrize("name", ["json", "orjson"])
+def test_json_codecs(name):
+    if name == "orjson":
+        pytest.importorskip("orjson")
+    codec = get_codec(name)
+    _frames = [codec.encode({"event": "test", "data": i}) for i in range(2)]
+
+    assert codec.decode(_frames[0]) == {"event": "test", "data": 0}
+    assert json.loads(codec.join(_frames)) == [
+        {"event": "test", "data": 0},
+        {"event": "test", "data": 1},
+    ]
+
+
+@pytest.mark.parametrize("count", [1, 20, 70000])
+def test_msgpack_join(count):
+    pytest.importorskip("msgpack")
+    codec = MsgpackCodec()
+    _frames = [codec.encode({"event": "test"})] * count
+    assert codec.decode(codec.join(_frames)) == [{"event": "test"}] * count
+
+
+def test_message_encode_once():
+    pytest.importorskip("orjson")
+    _message = Message.new({"event": "test"}, JsonCodec())
+    codec = OrjsonCodec()
+    assert _message.encode(codec) is _message.encode(codec)
+
+
+@pytest.mark.asyncio
+async def test_negotiate_codec():
+    pytest.importorskip("msgpack")
+    app = Quart(__name__)
+    broker = EventBroker(app, auth=False, codecs=[MsgpackCodec()])
+    client = app.test_client()
+
+    async with client.websocket(
+        "/events/ws", scope_base={"subprotocols": [MsgpackCodec().subprotocol]}
+    ) as ws:
+        _frame = await ws.receive()
+        assert isinstance(_frame, bytes)
+        assert MsgpackCodec().decode(_frame) == {"event": "_open"}
+
+    async with EventsCatcher(
+        client, blueprint_path="/events", codec=MsgpackCodec()
+    ) as _catcher:
+        async with _catcher.events(1) as _events:
+            while not broker.subscribers:
+                await asyncio.sleep(0.01)
+            await broker.put(event="test", data="value")
+
+    _events.assert_events(["test"])
+    assert list(_events)[0].data == {"data": "value"}
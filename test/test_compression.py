@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import pytest
+from quart import Quart
+
+from quart_events import EventBroker
+from quart_events.codecs import JsonCodec
+from quart_events.compression import (
+    ZlibCompressor,
+    ZstdCompressor,
+    get_compressor,
+    zstandard,
+)
+from quart_events.message import Message
+
+
+@pytest.mark.parametrize(
+    "compressor_class",
+    [
+        ZlibCompressor,
+        pytest.param(
+            ZstdCompressor,
+            marks=pytest.mark.skipif(
+                zstandard is None, reason="zstandard is not installed"
+            ),
+        ),
+    ],
+)
+def test_compressor(compressor_class):
+    compressor = compressor_class()
+    _data = b"x" * 10000
+    _compressed = compressor.compress(_data)
+    assert len(_compressed) < len(_data)
+    assert compressor.decompress(_compressed) == _data
+
+
+def test_get_compressor():
+    _expected = ZstdCompressor if zstandard is not None else ZlibCompressor
+    assert isinstance(get_compressor(), _expected)
+    assert isinstance(get_compressor("zlib"), ZlibCompressor)
+    with pytest.raises(ValueError):
+        get_compressor("unknown")
+
+
+def test_message_compress_once():
+    codec = JsonCodec()
+    compressor = ZlibCompressor()
+    _message = Message.new({"event": "test", "data": "x" * 1000}, codec)
+    _compressed = _message.compress(codec, compressor, _message.payload)
+    assert _message.compress(codec, compressor, _message.payload) is _compressed
+    assert compressor.decompress(_compressed).decode() == _message.payload
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("batch", [False, True])
+async def test_websocket_compression(batch):
+    app = Quart(__name__)
+    broker = EventBroker(
+        app, auth=False, compressor=ZlibCompressor(), compression_threshold=100
+    )
+    client = app.test_client()
+    _query_string = {"compress": "zlib"}
+    if batch:
+        _query_string["batch"] = "1"
+
+    async with client.websocket("/events/ws", query_string=_query_string) as ws:
+        assert json.loads(await ws.receive()) == {"event": "_open"}
+        while not broker.subscribers:
+            await asyncio.sleep(0.01)
+        await broker.put_many(
+            [
+                {"event": "small"},
+                {"event": "large", "data": "x" * 1000},
+                {"event": "small"},
+            ]
+        )
+        _frames = [await ws.receive() for _ in range(3)]
+
+    _small = [{"event": "small"}] if batch else {"event": "small"}
+    assert json.loads(_frames[0]) == _small
+    assert isinstance(_frames[1], bytes)
+    assert json.loads(ZlibCompressor().decompress(_frames[1])) == {
+        "event": "large",
+        "data": "x" * 1000,
+    }
+    assert json.loads(_frames[2]) == _small
+
+
+@pytest.mark.asyncio
+async def test_websocket_compression_not_requested():
+    app = Quart(__name__)
+    broker = EventBroker(
+        app, auth=False, compressor=ZlibCompressor(), compression_threshold=100
+    )
+
+    async with app.test_client().websocket("/events/ws") as ws:
+        assert json.loads(await ws.receive()) == {"event": "_open"}
+        while not broker.subscribers:
+            await asyncio.sleep(0.01)
+        await broker.put(event="large", data="x" * 1000)
+        _frame = await ws.receive()
+
+    assert isinstance(_frame, str)
+    assert json.loads(_frame)["event"] == "large"
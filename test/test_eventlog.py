@@ -0,0 +1,134 @@
+import os
+
+import pytest
+from quart import Quart
+
+from quart_events import EventBroker
+from quart_events.codecs import JsonCodec
+from quart_events.eventlog import EventLog
+from quart_events.message import Message
+
+
+codec = JsonCodec()
+
+
+def _message(id_):
+    return Message.new({"event": f"test{id_}"}, codec).stamp(id_, codec)
+
+
+def test_append_and_read(tmp_path):
+    log = EventLog(str(tmp_path), segment_bytes=100)
+    assert log.first_id is None
+    for i in range(1, 11):
+        log.append(_message(i))
+
+    assert len(os.listdir(tmp_path)) > 1
+    assert log.first_id == 1
+    assert log.last_id == 10
+    _messages = list(log.read(3, codec))
+    assert [_m.id for _m in _messages] == list(range(4, 11))
+    assert _messages[0].data == {"_id": 4, "event": "test4"}
+    assert list(log.read(10, codec)) == []
+    log.close()
+
+
+def test_recover(tmp_path):
+    log = EventLog(str(tmp_path))
+    for i in range(1, 4):
+        log.append(_message(i))
+    log.close()
+
+    # a crash in the middle of writing an event
+    (_segment,) = os.listdir(tmp_path)
+    with open(tmp_path / _segment, "ab") as f:
+        f.write(b"\x00\x00\x00\x00\x00\x00\x00\x04\x00\x00\x01\x00partial")
+
+    log = EventLog(str(tmp_path))
+    assert log.last_id == 3
+    log.append(_message(4))
+    assert [_m.id for _m in log.read(0, codec)] == [1, 2, 3, 4]
+    log.close()
+
+
+def test_expire(tmp_path):
+    log = EventLog(str(tmp_path), segment_bytes=100, max_bytes=300)
+    for i in range(1, 31):
+        log.append(_message(i))
+
+    assert sum(os.path.getsize(tmp_path / _f) for _f in os.listdir(tmp_path)) < 400
+    assert log.first_id > 1
+    assert [_m.id for _m in log.read(0, codec)][-1] == 30
+    log.close()
+
+
+def test_expire_without_stat(tmp_path, monkeypatch):
+    log = EventLog(str(tmp_path), segment_bytes=100)
+    for i in range(1, 11):
+        log.append(_message(i))
+    log.close()
+
+    # sizes of existing segments are read once when the log is opened
+    log = EventLog(str(tmp_path), segment_bytes=100, max_bytes=300)
+
+    def _stat(path):
+        raise AssertionError("segments are not stat'd by expire()")
+
+    monkeypatch.setattr("quart_events.eventlog.os.path.getsize", _stat)
+    monkeypatch.setattr("quart_events.eventlog.os.path.getmtime", _stat)
+    for i in range(11, 31):
+        log.append(_message(i))
+    log.expire()
+
+    monkeypatch.undo()
+    assert sum(os.path.getsize(tmp_path / _f) for _f in os.listdir(tmp_path)) < 400
+    assert [_m.id for _m in log.read(0, codec)][-1] == 30
+    log.close()
+
+
+@pytest.mark.asyncio
+async def test_broker_replay_from_log(tmp_path):
+    broker = EventBroker(
+        Quart(__name__), auth=False, replay_size=2, event_log=EventLog(str(tmp_path))
+    )
+    for i in range(5):
+        await broker.put(event=f"ns{i % 2}:test{i}")
+
+    # older than the replay buffer; read from the log
+    assert [_m.event for _m in broker.replay(0, "ns0")] == [
+        "ns0:test0",
+        "ns0:test2",
+        "ns0:test4",
+    ]
+    assert [_m.id for _m in broker.replay(3)] == [4, 5]
+    await broker.stop()
+
+    # ids continue after a restart
+    broker = EventBroker(Quart(__name__), auth=False, event_log=EventLog(str(tmp_path)))
+    await broker.put(event="ns0:test5")
+    assert [_m.id for _m in broker.replay(4)] == [5, 6]
+    await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_subscribe_from_log(tmp_path):
+    log = EventLog(str(tmp_path), segment_bytes=1)
+    broker = EventBroker(Quart(__name__), auth=False, event_log=log)
+    broker.replay_chunk_size = 2
+    for i in range(5):
+        await broker.put(event=f"test{i}")
+
+    _ids = list()
+    async for _message in broker.subscribe(since=0):
+        _ids.append(_message.id)
+        if _message.id == 5:
+            await broker.put(event="test5")
+        elif _message.id == 6:
+            break
+    assert _ids == [1, 2, 3, 4, 5, 6]
+
+    # segments deleted while the log is read are resynced
+    _chunks = broker._replay_chunks(0)
+    assert [_m.id for _m in next(_chunks)] == [1, 2]
+    os.unlink(log._segment_path(3))
+    assert next(_chunks) is None
+    await broker.stop()
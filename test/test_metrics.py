@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import pytest
+from quart import Quart
+
+from quart_events import EventBroker
+from quart_events.metrics import Histogram, namespace_of
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for _value in (0.05, 0.05, 0.5, 5.0):
+        histogram.observe(_value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(1.0) == float("inf")
+    assert Histogram().quantile(0.5) is None
+
+
+def test_namespace_of():
+    assert namespace_of("orders:created") == "orders"
+    assert namespace_of("orders") == "orders"
+    assert namespace_of(None) == ""
+
+
+@pytest.mark.asyncio
+async def test_broker_metrics():
+    broker = EventBroker(Quart(__name__), auth=False)
+    with broker.queue("ns0") as q0, broker.queue() as q1:
+        await broker.put(event="ns0:test0")
+        await broker.put(event="ns1:test1")
+        await broker.put_many([{"event": "ns1:test2"}, {"event": "ns1:test3"}])
+
+        _stats = broker.metrics.snapshot()
+        assert _stats["subscribers"] == 2
+        assert _stats["queue_depth"] == {"total": 5, "max": 4}
+
+    assert _stats["events_published"] == 4
+    assert _stats["events_delivered"] == 5
+    assert _stats["events_by_namespace"] == {"ns0": 1, "ns1": 3}
+
+
+@pytest.mark.asyncio
+async def test_namespace_limit():
+    broker = EventBroker(Quart(__name__), auth=False)
+    broker.metrics.max_namespaces = 2
+    with broker.queue():
+        for i in range(4):
+            await broker.put(event=f"ns{i}:test")
+        await broker.put(event="ns0:test")
+
+    assert broker.metrics.events == {"ns0": 2, "ns1": 1, "_other": 2}
+
+
+@pytest.mark.asyncio
+async def test_stats_route():
+    app = Quart(__name__)
+    broker = EventBroker(app, auth=False, stats_route=True)
+    client = app.test_client()
+
+    async with client.websocket("/events/ws") as ws:
+        assert json.loads(await ws.receive()) == {"event": "_open"}
+        while not broker.subscribers:
+            await asyncio.sleep(0.01)
+        await broker.put(event="ns0:test")
+        assert json.loads(await ws.receive()) == {"event": "ns0:test"}
+
+    while not broker.metrics.disconnects:
+        await asyncio.sleep(0.01)
+
+    r = await client.get("/events/stats")
+    _stats = await r.get_json()
+    assert _stats["connections"] == 1
+    assert _stats["events_sent"] == 1
+    assert _stats["delivery_latency_seconds"]["count"] == 1
+    assert _stats["disconnects"] == {"cancel": 1}
+
+    r = await client.get("/events/stats", query_string={"format": "prometheus"})
+    assert r.content_type.startswith("text/plain")
+    _text = await r.get_data(as_text=True)
+    assert 'quart_events_events_total{namespace="ns0"} 1' in _text
+    assert 'quart_events_delivery_latency_seconds_bucket{le="+Inf"} 1' in _text
+    assert _text.count("# TYPE quart_events_delivery_latency_seconds") == 1
+    assert "# TYPE quart_events_delivery_latency_seconds histogram" in _text
+
+
+@pytest.mark.asyncio
+async def test_stats_route_disabled():
+    app = Quart(__name__)
+    EventBroker(app, auth=False)
+
+    r = await app.test_client().get("/events/stats")
+    assert r.status_code == 404
@@ -0,0 +1,50 @@
+import pytest
+
+from quart_events.routing import NamespaceIndex, parse_subscription
+from quart_events.subscriber import SubscriberQueue
+
+
+def test_parse_subscription():
+    _subscription = parse_subscription("orders:*, inventory:low_*,ns0,*:deleted")
+    assert _subscription.prefixes == {"orders:", "inventory:low_", "ns0"}
+    assert _subscription.pattern is not None
+    assert _subscription.overlapping
+
+    assert _subscription.matches("orders:created")
+    assert _subscription.matches("inventory:low_stock")
+    assert _subscription.matches("users:deleted")
+    assert not _subscription.matches("inventory:high_stock")
+    assert not _subscription.matches(None)
+
+    assert parse_subscription(None).everything
+    assert parse_subscription("ns0,*").everything
+    assert not parse_subscription("ns0").overlapping
+    assert parse_subscription("b,a") is parse_subscription("b,a")
+
+
+@pytest.mark.asyncio
+async def test_index_multiple_patterns():
+    index = NamespaceIndex()
+    q_all = SubscriberQueue()
+    q_multi = SubscriberQueue("ns0,ns0:test*,*:test?")
+    q_glob = SubscriberQueue("*:test?")
+    for _queue in (q_all, q_multi, q_glob):
+        index.add(_queue, _queue.namespace)
+
+    # each queue is matched once even when several of its patterns match
+    assert sorted(map(id, index.match("ns0:test1"))) == sorted(
+        map(id, [q_all, q_multi, q_glob])
+    )
+    assert set(index.match("ns1:test2")) == {q_all, q_multi, q_glob}
+    assert set(index.match("ns0:other")) == {q_all, q_multi}
+    assert set(index.match("ns1:other")) == {q_all}
+
+    # removing twice is harmless
+    index.remove(q_multi, q_multi.namespace)
+    index.remove(q_multi, q_multi.namespace)
+    assert set(index.match("ns0:test1")) == {q_all, q_glob}
+    assert index._overlapping == 0
+
+    index.remove(q_glob, q_glob.namespace)
+    index.remove(q_all, q_all.namespace)
+    assert len(index) == 0
@@ -0,0 +1,89 @@
+import json
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from quart import Quart
+
+from quart_events import EventBroker
+from quart_events.tokens import NullToken, Token, TokenSigner, TokenStore
+
+
+def _token(age: int) -> Token:
+    return Token(value=uuid4(), date=datetime.utcnow() - timedelta(seconds=age))
+
+
+def test_prune():
+    store = TokenStore(expire_seconds=10)
+    _expired = [_token(20 + i) for i in range(5)]
+    _live = [_token(0) for _ in range(3)]
+    for _t in _expired + _live:
+        store.add(_t)
+
+    assert store.prune(limit=2) == 2
+    assert len(store) == 6
+    assert store.prune() == 3
+    assert len(store) == 3
+    assert all(str(_t) in store for _t in _live)
+    assert store.stats() == {"live": 3, "issued": 8, "expired": 5, "evicted": 0}
+    assert store.is_expired(_expired[0])
+    assert not store.is_expired(_live[0])
+    assert store.is_expired(NullToken())
+
+
+def test_max_size():
+    store = TokenStore(expire_seconds=10, max_size=2)
+    _oldest = _token(5)
+    store.add(_oldest)
+    store.add(_token(1))
+    store.add(_token(0))
+
+    assert len(store) == 2
+    assert str(_oldest) not in store
+    assert store.evicted == 1
+
+
+@pytest.mark.asyncio
+async def test_background_prune():
+    store = TokenStore(expire_seconds=10, prune_interval=0.01)
+    store.add(_token(20))
+    assert store._task is not None
+
+    await store._task
+    assert len(store) == 0
+    assert store.expired == 1
+
+
+def test_signer():
+    signer = TokenSigner(b"00000000000000000000000000000000", expire_seconds=10)
+    _token = Token.new()
+    _signed = signer.sign(_token)
+
+    _verified = signer.unsign(_signed)
+    assert _verified.value == _token.value
+    assert abs((_verified.date - _token.date).total_seconds()) < 2
+
+    # change the signed value; the last signature character may only carry padding bits
+    _tampered = ("1" if _signed.startswith("0") else "0") + _signed[1:]
+    assert isinstance(signer.unsign(_tampered), NullToken)
+    assert isinstance(
+        TokenSigner(b"11111111111111111111111111111111", 10).unsign(_signed), NullToken
+    )
+
+
+@pytest.mark.asyncio
+async def test_stateless_tokens():
+    app = Quart(__name__)
+    app.config["SECRET_KEY"] = b"00000000000000000000000000000000"
+    broker = EventBroker(app, stateless_tokens=True)
+    client = app.test_client()
+
+    async with client.websocket("/events/ws") as ws:
+        assert json.loads(await ws.receive())["event"] == "error"
+
+    r = await client.get("/events/auth")
+    assert r.status_code == 200
+    assert len(broker._tokens) == 0
+
+    async with client.websocket("/events/ws") as ws:
+        assert json.loads(await ws.receive()) == {"event": "_open"}
@@ -7,6 +7,7 @@ from uuid import uuid4
 import pytest
 import quart
 
+from quart_events import EventBroker, EventBrokerAuthError
 from quart_events.pytest_plugin import Event
 
 
@@ -107,3 +108,152 @@ async def test_namespaced_events2(app_test_client, quart_events_catcher):
 async def test_plugin_timeout(app_test_client, quart_events_catcher):
     async with quart_events_catcher.events(5, namespace="ns0", timeout=1) as _events:
         await app_test_client.get("/generate")
+
+
+@pytest.mark.asyncio
+async def test_websocket_batch(app_test_client):
+    r = await app_test_client.get("/events/auth")
+    assert r.status_code == 200
+
+    async with app_test_client.websocket(
+        "/events/ws/ns0", query_string={"batch": "1"}
+    ) as ws:
+        assert json.loads(await ws.receive()) == {"event": "_open"}
+        await asyncio.sleep(0.1)
+        await app_test_client.get("/generate")
+        _frame = json.loads(await ws.receive())
+
+    assert isinstance(_frame, list)
+    assert [_event["event"] for _event in _frame] == ["ns0:test0", "ns0:test1"]
+
+
+@pytest.mark.asyncio
+async def test_sse(app_test_client):
+    r = await app_test_client.get("/events/auth")
+    assert r.status_code == 200
+
+    async with app_test_client.request("/events/sse/ns1") as connection:
+        await connection.send_complete()
+        assert await connection.receive() == b'data: {"event": "_open"}\n\n'
+        await asyncio.sleep(0.1)
+        await app_test_client.get("/generate")
+        _frames = [await connection.receive() for _ in range(2)]
+
+    assert [json.loads(_frame[len(b"data: ") :]) for _frame in _frames] == [
+        {"data": "30db7186-e66a-43eb-a32a-d0311ca8d153", "event": "ns1:test2"},
+        {"data": "6ca404d0-7416-4409-aa2a-c9120360c04f", "event": "ns1:test3"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_websocket_shutdown():
+    app = quart.Quart(__name__)
+    broker = EventBroker(app, auth=False, reconnect_after=1, reconnect_jitter=2)
+    client = app.test_client()
+
+    async with client.websocket("/events/ws") as ws:
+        assert json.loads(await ws.receive()) == {"event": "_open"}
+        while not broker.subscribers:
+            await asyncio.sleep(0.01)
+        await broker.put(event="test")
+        await broker.stop()
+
+        assert json.loads(await ws.receive()) == {"event": "test"}
+        _close = json.loads(await ws.receive())
+        assert _close["event"] == "_close"
+        assert 1 <= _close["reconnect_after"] <= 3
+
+    async with client.websocket("/events/ws") as ws:
+        assert json.loads(await ws.receive()) == {
+            "event": "_rejected",
+            "message": "shutting down",
+        }
+
+
+@pytest.mark.asyncio
+async def test_websocket_publish():
+    app = quart.Quart(__name__)
+    broker = EventBroker(app, auth=False, client_publish=True)
+
+    @broker.publish
+    def check_publish(data: Dict) -> None:
+        if data["event"].startswith("admin:"):
+            raise EventBrokerAuthError("not allowed to publish admin events")
+
+    async with app.test_client().websocket("/events/ws") as ws:
+        assert json.loads(await ws.receive()) == {"event": "_open"}
+        while not broker.subscribers:
+            await asyncio.sleep(0.01)
+
+        await ws.send(json.dumps({"event": "chat", "data": "hello"}))
+        assert json.loads(await ws.receive()) == {"event": "chat", "data": "hello"}
+
+        await ws.send(json.dumps([{"event": "chat", "data": i} for i in range(3)]))
+        for i in range(3):
+            assert json.loads(await ws.receive()) == {"event": "chat", "data": i}
+
+        # keys are event fields, not keyword arguments
+        await ws.send(json.dumps({"event": "chat", "self": 1, "conflate_key": "a"}))
+        assert json.loads(await ws.receive()) == {"event": "chat", "self": 1}
+
+        for _frame, _message in [
+            (
+                [{"event": "chat"}, {"event": "admin:reset"}],
+                "not allowed to publish admin events",
+            ),
+            ({"event": "_close"}, "reserved event name"),
+            ({"data": "no event name"}, "invalid frame"),
+            ([{"event": "chat", "conflate_key": "a"}], "invalid frame"),
+            ("not json", "invalid frame"),
+        ]:
+            await ws.send(_frame if isinstance(_frame, str) else json.dumps(_frame))
+            assert json.loads(await ws.receive()) == {
+                "event": "_publish_rejected",
+                "message": _message,
+            }
+
+    assert broker.metrics.client_published == 5
+    assert broker.metrics.publish_rejected == {
+        "not allowed to publish admin events": 1,
+        "reserved event name": 1,
+        "invalid frame": 3,
+    }
+
+
+@pytest.mark.asyncio
+async def test_websocket_publish_rate():
+    app = quart.Quart(__name__)
+    broker = EventBroker(
+        app, auth=False, client_publish=True, publish_rate=0.001, publish_burst=2
+    )
+
+    async with app.test_client().websocket("/events/ws") as ws:
+        assert json.loads(await ws.receive()) == {"event": "_open"}
+        while not broker.subscribers:
+            await asyncio.sleep(0.01)
+
+        await ws.send(json.dumps([{"event": "a"}, {"event": "b"}]))
+        assert json.loads(await ws.receive()) == {"event": "a"}
+        assert json.loads(await ws.receive()) == {"event": "b"}
+
+        await ws.send(json.dumps({"event": "c"}))
+        assert json.loads(await ws.receive()) == {
+            "event": "_publish_rejected",
+            "message": "publish rate exceeded",
+        }
+
+
+
+@pytest.mark.asyncio
+async def test_serve_again_after_shutdown():
+    app = quart.Quart(__name__)
+    broker = EventBroker(app, auth=False)
+
+    for _ in range(2):
+        async with app.test_app() as test_app:
+            async with test_app.test_client().websocket("/events/ws") as ws:
+                assert json.loads(await ws.receive()) == {"event": "_open"}
+                while not broker.subscribers:
+                    await asyncio.sleep(0.01)
+                await broker.put(event="test")
+                assert json.loads(await ws.receive()) == {"event": "test"}